@@ -28,6 +28,12 @@ setup(
         'setuptools',
         'Flask',
     ],
+    extras_require={
+        'inotify': ['pyinotify'],
+        'msgpack': ['msgpack'],
+        # futures is needed by gunicorn's gthread workers on Python 2
+        'prefork': ['gunicorn', 'gevent', 'futures'],
+    },
     entry_points="""
     [console_scripts]
     flask-ctl = presence_analyzer.script:run
@@ -36,5 +42,9 @@ setup(
     [paste.app_factory]
     main = presence_analyzer.script:make_app
     debug = presence_analyzer.script:make_debug
+    prefork = presence_analyzer.script:make_prefork_app
+
+    [paste.server_factory]
+    prefork = presence_analyzer.script:make_prefork_server
     """,
 )
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Builds fingerprinted and precompressed copies of static assets.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import mimetypes
+from threading import Lock
+
+from presence_analyzer.compress import is_compressible_type
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+MANIFEST = 'manifest.json'
+
+# Fingerprinted assets never change, so they may be cached for a year.
+MAX_AGE = 365 * 24 * 3600
+
+_manifest = {}
+_manifest_lock = Lock()
+
+
+def fingerprint(path):
+    """
+    Returns short content hash of a file.
+    """
+    digest = hashlib.md5()
+    with open(path, 'rb') as assetfile:
+        for chunk in iter(lambda: assetfile.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def is_compressible(filename):
+    """
+    Checks if file type benefits from compression.
+    """
+    return is_compressible_type(mimetypes.guess_type(filename)[0] or '')
+
+
+def build_assets(static_dir, output_dir):
+    """
+    Copies static assets to output_dir under content hashed names.
+
+    Compressible assets also get a gzipped copy next to them. Writes
+    a manifest mapping original names to hashed ones and returns it.
+    """
+    import gzip
+    import shutil
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            source = os.path.join(root, filename)
+            name = os.path.relpath(source, static_dir).replace(os.sep, '/')
+            base, ext = os.path.splitext(name)
+            hashed = '{0}.{1}{2}'.format(base, fingerprint(source), ext)
+            target = os.path.join(output_dir, hashed)
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            shutil.copyfile(source, target)
+            if is_compressible(filename):
+                with open(source, 'rb') as sourcefile:
+                    with gzip.open(target + '.gz', 'wb', 9) as gzfile:
+                        shutil.copyfileobj(sourcefile, gzfile)
+            manifest[name] = hashed
+            log.info('%s -> %s', name, hashed)
+
+    manifest_path = os.path.join(output_dir, MANIFEST)
+    with open(manifest_path + '.tmp', 'w') as manifestfile:
+        json.dump(manifest, manifestfile, indent=2, sort_keys=True)
+    os.rename(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+
+def load_manifest(output_dir):
+    """
+    Returns manifest of built assets, empty if assets were not built.
+
+    Manifest is read again when the file changes.
+    """
+    path = os.path.join(output_dir, MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return {}
+    with _manifest_lock:
+        if _manifest.get('key') != (path, mtime):
+            with open(path, 'r') as manifestfile:
+                _manifest['manifest'] = json.load(manifestfile)
+            _manifest['key'] = (path, mtime)
+        return _manifest['manifest']
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Local disk cache of user avatars.
+"""
+
+import os
+import time
+import logging
+import threading
+
+from presence_analyzer.main import app
+from presence_analyzer import utils
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+_locks = {}
+_locks_lock = threading.Lock()
+_urls = {}
+_urls_lock = threading.Lock()
+
+
+def cache_dir():
+    """
+    Returns avatar cache directory, creating it when needed.
+    """
+    path = app.config['AVATAR_CACHE_DIR']
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # created by other thread meanwhile
+            pass
+    return path
+
+
+def avatar_path(user_id):
+    """
+    Returns path of cached avatar of given user.
+    """
+    return os.path.join(cache_dir(), str(user_id))
+
+
+def avatar_urls():
+    """
+    Returns remote avatar URLs of users from DATA_XML by user id.
+
+    DATA_XML is parsed again only when the file or data generation
+    changes.
+    """
+    path = app.config['DATA_XML']
+    try:
+        key = (path, os.stat(path).st_mtime, utils.get_generation())
+    except OSError:
+        key = None
+    with _urls_lock:
+        if key is None or _urls.get('key') != key:
+            _urls['urls'] = dict(
+                (user['user_id'], user['avatar'])
+                for user in utils.data_from_xml()
+            )
+            _urls['key'] = key
+        return _urls['urls']
+
+
+def user_lock(user_id):
+    """
+    Returns lock guarding downloads of given user's avatar.
+    """
+    with _locks_lock:
+        return _locks.setdefault(user_id, threading.Lock())
+
+
+def is_fresh(path):
+    """
+    Checks if cached avatar was validated within AVATAR_MAX_AGE.
+
+    Validation time is kept as modification time of the meta file.
+    """
+    from presence_analyzer.refresh import meta_path
+    try:
+        validated = os.stat(meta_path(path)).st_mtime
+    except OSError:
+        return False
+    max_age = app.config.get('AVATAR_MAX_AGE', 24 * 3600)
+    return os.path.exists(path) and time.time() - validated < max_age
+
+
+def fetch(user_id, url):
+    """
+    Downloads avatar unless cached copy is fresh.
+
+    Stale copies are revalidated with a conditional request. Returns
+    path of cached avatar or None when it could not be downloaded.
+    """
+    from presence_analyzer import refresh
+    path = avatar_path(user_id)
+    with user_lock(user_id):
+        if is_fresh(path):
+            return path
+        try:
+            if refresh.download(
+                    url, path, timeout=app.config.get('AVATAR_TIMEOUT', 10)):
+                evict(app.config.get('AVATAR_CACHE_SIZE', 50 * 1024 * 1024))
+            else:
+                # not modified, so it's valid for another AVATAR_MAX_AGE
+                os.utime(refresh.meta_path(path), None)
+        except Exception as error:  # pylint: disable=broad-except
+            # network failures are expected, e.g. when intranet is down
+            expected = isinstance(error, (IOError, refresh.ValidationError))
+            log.warning(
+                'Could not fetch avatar %s: %s', url, error,
+                exc_info=not expected
+            )
+            if not os.path.exists(path):
+                return None
+    return path
+
+
+def evict(max_size):
+    """
+    Removes least recently used avatars until cache fits max_size bytes.
+
+    Serving an avatar updates its access time, see touch().
+    """
+    from presence_analyzer.refresh import meta_path
+    directory = cache_dir()
+    entries = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if not name.isdigit() or not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        entries.append((stat.st_atime, stat.st_size, path))
+
+    total = sum(size for atime, size, path in entries)
+    for atime, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        log.debug('Evicting avatar %s', path)
+        for victim in (path, meta_path(path)):
+            try:
+                os.unlink(victim)
+            except OSError:
+                pass
+        total -= size
+
+
+def touch(path):
+    """
+    Marks cached avatar as recently used.
+
+    Only access time is updated, modification time is used in ETag.
+    """
+    try:
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+    except OSError:
+        pass
+
+
+def prefetch():
+    """
+    Downloads avatars of all users from DATA_XML.
+    """
+    with app.app_context():
+        urls = avatar_urls()
+        for user_id, url in sorted(urls.items()):
+            fetch(user_id, url)
+        log.info('Prefetched %d avatars', len(urls))
+
+
+def start_prefetch():
+    """
+    Starts prefetching avatars in a background thread.
+    """
+    thread = threading.Thread(target=prefetch, name='avatar-prefetch')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def reset():
+    """
+    Drops download locks and cached avatar URLs.
+
+    Forked processes must call it, locks held by threads of the parent
+    would never be released in the child.
+    """
+    global _locks_lock, _urls_lock  # pylint: disable=global-statement
+    _locks_lock = threading.Lock()
+    _urls_lock = threading.Lock()
+    _locks.clear()
+    _urls.clear()
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+WSGI middleware compressing responses.
+"""
+
+import re
+import zlib
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/json',
+    'application/javascript',
+    'application/x-javascript',
+    'image/svg+xml',
+)
+
+# Structured syntax suffixes of vendor types, e.g. application/vnd.x+json.
+COMPRESSIBLE_SUFFIXES = ('+json', '+xml')
+
+ETAG_SUFFIX = re.compile(r'-(gzip|deflate)"')
+
+
+def accepted_encoding(accept_encoding):
+    """
+    Chooses gzip or deflate from Accept-Encoding header value.
+
+    Returns None when client accepts neither of them.
+    """
+    accepted = {}
+    for item in accept_encoding.split(','):
+        parts = item.strip().split(';')
+        quality = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[parts[0].strip().lower()] = quality
+
+    for encoding in ('gzip', 'deflate'):
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > 0:
+            return encoding
+    return None
+
+
+def is_compressible_type(content_type):
+    """
+    Checks if content of given Content-Type benefits from compression.
+    """
+    mimetype = content_type.split(';')[0].strip().lower()
+    return (mimetype.startswith(COMPRESSIBLE_TYPES) or
+            mimetype.endswith(COMPRESSIBLE_SUFFIXES))
+
+
+def compress(body, encoding, level):
+    """
+    Compresses body with gzip or deflate.
+    """
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(
+            level, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+        )
+    else:
+        compressor = zlib.compressobj(level)
+    return compressor.compress(body) + compressor.flush()
+
+
+def etag_for(etag, encoding):
+    """
+    Makes ETag of compressed representation differ from the original one.
+    """
+    if etag.endswith('"'):
+        return '{0}-{1}"'.format(etag[:-1], encoding)
+    return etag
+
+
+class CompressionMiddleware(object):
+    """
+    Compresses text responses for clients accepting gzip or deflate.
+
+    Responses smaller than COMPRESS_MIN_SIZE bytes are sent as they are.
+    Compressed bodies of the last COMPRESS_CACHE_SIZE distinct responses
+    are kept, so repeated responses are compressed only once.
+    """
+
+    def __init__(self, app, config):
+        self.app = app
+        self.config = config
+        self.cache = OrderedDict()
+        self.lock = Lock()
+
+    def compressed(self, body, encoding):
+        """
+        Returns compressed body, reusing cached result when possible.
+        """
+        key = (encoding, hashlib.md5(body).digest(), len(body))
+        with self.lock:
+            if key in self.cache:
+                result = self.cache.pop(key)
+                self.cache[key] = result
+                return result
+
+        result = compress(
+            body, encoding, self.config.get('COMPRESS_LEVEL', 6)
+        )
+        with self.lock:
+            self.cache[key] = result
+            cache_size = self.config.get('COMPRESS_CACHE_SIZE', 128)
+            while len(self.cache) > cache_size:
+                self.cache.popitem(last=False)
+        return result
+
+    def __call__(self, environ, start_response):
+        if (not self.config.get('COMPRESS', True) or
+                environ.get('REQUEST_METHOD') == 'HEAD'):
+            return self.app(environ, start_response)
+        encoding = accepted_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        revalidated = None
+        if 'HTTP_IF_NONE_MATCH' in environ:
+            # let the app match ETags of compressed representations
+            match = ETAG_SUFFIX.search(environ['HTTP_IF_NONE_MATCH'])
+            if match is not None:
+                revalidated = match.group(1)
+            environ['HTTP_IF_NONE_MATCH'] = ETAG_SUFFIX.sub(
+                '"', environ['HTTP_IF_NONE_MATCH']
+            )
+
+        response = {}
+        chunks = []
+
+        def buffered_start_response(status, headers, exc_info=None):
+            """
+            Holds status and headers until the body is known.
+            """
+            response['status'] = status
+            response['headers'] = headers
+            response['exc_info'] = exc_info
+            return chunks.append
+
+        app_iter = self.app(environ, buffered_start_response)
+        try:
+            for chunk in app_iter:
+                chunks.append(chunk)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+        body = b''.join(chunks)
+        headers = list(response['headers'])
+        names = dict((name.lower(), value) for name, value in headers)
+        content_type = names.get('content-type', '')
+        if is_compressible_type(content_type):
+            vary = names.get('vary')
+            if vary is None:
+                headers.append(('Vary', 'Accept-Encoding'))
+            elif 'accept-encoding' not in vary.lower():
+                headers = [
+                    (name, value + ', Accept-Encoding')
+                    if name.lower() == 'vary' else (name, value)
+                    for name, value in headers
+                ]
+
+            if (encoding is not None and
+                    response['status'].startswith('200') and
+                    'content-encoding' not in names and
+                    len(body) >= self.config.get('COMPRESS_MIN_SIZE', 500)):
+                body = self.compressed(body, encoding)
+                headers = [
+                    (name, etag_for(value, encoding))
+                    if name.lower() == 'etag' else (name, value)
+                    for name, value in headers
+                    if name.lower() != 'content-length'
+                ]
+                headers.append(('Content-Encoding', encoding))
+                headers.append(('Content-Length', str(len(body))))
+
+        elif response['status'].startswith('304') and revalidated:
+            # confirm the compressed representation client has
+            headers = [
+                (name, etag_for(value, revalidated))
+                if name.lower() == 'etag' else (name, value)
+                for name, value in headers
+            ]
+
+        start_response(response['status'], headers, response['exc_info'])
+        return [body]
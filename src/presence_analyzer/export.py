@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Exports API responses to static files.
+"""
+
+import os
+import shutil
+import logging
+import multiprocessing
+
+from presence_analyzer.main import app
+from presence_analyzer import storage
+from presence_analyzer.compress import compress
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+USER_ENDPOINTS = ['mean_time_weekday', 'presence_weekday', 'mean_start_end']
+
+
+def user_urls(user_id):
+    """
+    Returns URLs of API endpoints of given user.
+    """
+    return [
+        '/api/v1/{0}/{1}'.format(endpoint, user_id)
+        for endpoint in USER_ENDPOINTS
+    ]
+
+
+def export_urls(args):
+    """
+    Writes responses of given URLs with gzipped copies to output_dir.
+
+    Returns number of written responses.
+    """
+    output_dir, urls = args
+    client = app.test_client()
+    for url in urls:
+        resp = client.get(url, headers={'Accept': 'application/json'})
+        if resp.status_code != 200:
+            raise RuntimeError(
+                '{0} responded with {1}'.format(url, resp.status_code)
+            )
+        path = os.path.join(output_dir, *url.strip('/').split('/'))
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                # created by other process meanwhile
+                pass
+        with open(path, 'wb') as jsonfile:
+            jsonfile.write(resp.data)
+        with open(path + '.gz', 'wb') as gzfile:
+            gzfile.write(compress(resp.data, 'gzip', 9))
+    return len(urls)
+
+
+def export_static(output_dir, processes=None):
+    """
+    Exports users listing and every user's statistics to output_dir.
+
+    Files are named after API URLs, e.g. api/v1/mean_time_weekday/10,
+    so a web server can serve them directly. Users are split between
+    processes. New export replaces output_dir only when it's complete.
+    Returns number of exported responses.
+    """
+    output_dir = os.path.abspath(output_dir.rstrip(os.sep))
+    tmp_dir = '{0}.tmp-{1}'.format(output_dir, os.getpid())
+    old_dir = '{0}.old-{1}'.format(output_dir, os.getpid())
+
+    # load data once, so forked workers share it
+    with app.app_context():
+        user_ids = sorted(storage.get_storage().user_ids())
+    storage.reset()
+
+    tasks = [(tmp_dir, ['/api/v1/users'])]
+    tasks.extend((tmp_dir, user_urls(user_id)) for user_id in user_ids)
+    pool = multiprocessing.Pool(processes)
+    try:
+        count = sum(pool.imap_unordered(export_urls, tasks, chunksize=16))
+    except Exception:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    pool.close()
+    pool.join()
+
+    if os.path.exists(output_dir):
+        os.rename(output_dir, old_dir)
+    os.rename(tmp_dir, output_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    log.info('Exported %d responses to %s', count, output_dir)
+    return count
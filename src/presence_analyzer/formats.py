@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Wire formats of API responses.
+"""
+
+import time
+from json import dumps
+
+from presence_analyzer.compress import compress
+
+JSON = 'application/json'
+COLUMNAR = 'application/vnd.presence-analyzer.columnar+json'
+MSGPACK = 'application/x-msgpack'
+
+_msgpack = {}
+
+
+def to_columnar(data):
+    """
+    Turns list of rows into columns.
+
+    Rows given as sequences become a list of columns, rows given as dicts
+    become a dict of columns. Anything else is returned unchanged, e.g.:
+
+    [('Mon', 0), ('Tue', 30047)] -> [['Mon', 'Tue'], [0, 30047]]
+    """
+    if not isinstance(data, list) or not data:
+        return data
+    if all(isinstance(row, (list, tuple)) for row in data):
+        if len(set(len(row) for row in data)) == 1:
+            return [list(column) for column in zip(*data)]
+    elif all(isinstance(row, dict) for row in data):
+        keys = data[0].keys()
+        if all(row.keys() == keys for row in data):
+            return dict((key, [row[key] for row in data]) for key in keys)
+    return data
+
+
+def encode_json(data):
+    """
+    Encodes data as JSON.
+    """
+    return dumps(data)
+
+
+def encode_compact_json(data):
+    """
+    Encodes data as JSON without whitespace after separators.
+
+    Used by benchmark() only, to tell the gain of compact separators
+    from the gain of columnar layout.
+    """
+    return dumps(data, separators=(',', ':'))
+
+
+def encode_columnar(data):
+    """
+    Encodes data as columnar JSON.
+    """
+    return dumps(to_columnar(data), separators=(',', ':'))
+
+
+def load_msgpack():
+    """
+    Imports msgpack on first use. Returns None when it's not installed.
+    """
+    if 'module' not in _msgpack:
+        try:
+            import msgpack
+        except ImportError:  # pragma: no cover
+            msgpack = None  # pylint: disable=invalid-name
+        _msgpack['module'] = msgpack
+    return _msgpack['module']
+
+
+def encode_msgpack(data):
+    """
+    Encodes columnar data as MessagePack.
+    """
+    return load_msgpack().packb(to_columnar(data), use_bin_type=False)
+
+
+ENCODERS = [
+    (JSON, encode_json),
+    (COLUMNAR, encode_columnar),
+    (MSGPACK, encode_msgpack),
+]
+
+
+def available():
+    """
+    Returns (mimetype, encoder) pairs usable in this environment.
+    """
+    return [
+        (mimetype, encoder) for mimetype, encoder in ENCODERS
+        if mimetype != MSGPACK or load_msgpack() is not None
+    ]
+
+
+def negotiate(accept_mimetypes):
+    """
+    Picks mimetype and encoder for request's Accept header.
+
+    Plain JSON is used unless client prefers other format.
+    """
+    # import msgpack only for clients asking for it explicitly
+    encoders = [
+        (mimetype, encoder) for mimetype, encoder in ENCODERS
+        if mimetype != MSGPACK or (
+            MSGPACK in accept_mimetypes.values() and
+            load_msgpack() is not None
+        )
+    ]
+    best = accept_mimetypes.best_match(
+        [mimetype for mimetype, encoder in encoders], default=JSON
+    )
+    if accept_mimetypes[best] <= accept_mimetypes[JSON]:
+        best = JSON
+    return best, dict(encoders)[best]
+
+
+def benchmark(datasets, repeat=10, level=6):
+    """
+    Measures payload size and encoding time of every format.
+
+    Returns list of (mimetype, total size in bytes, total gzipped size
+    in bytes, seconds per pass). Plain JSON with compact separators is
+    measured too, as columnar JSON uses them. Responses are gzipped by the
+    compression middleware, so the gzipped size is what clients get.
+    """
+    encoders = available()
+    encoders.insert(1, (JSON + ' (compact)', encode_compact_json))
+    result = []
+    for mimetype, encoder in encoders:
+        bodies = [encoder(data) for data in datasets]
+        size = sum(len(body) for body in bodies)
+        gzip_size = sum(
+            len(compress(body, 'gzip', level)) for body in bodies
+        )
+        start = time.time()
+        for i in range(repeat):
+            for data in datasets:
+                encoder(data)
+        result.append(
+            (mimetype, size, gzip_size, (time.time() - start) / repeat)
+        )
+    return result
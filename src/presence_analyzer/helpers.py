@@ -2,3 +2,30 @@
 """
 Helper functions used in templates.
 """
+from flask import url_for
+
+from presence_analyzer.main import app
+from presence_analyzer import assets
+
+
+@app.template_global()
+def asset_url(filename):
+    """
+    Returns URL of fingerprinted static asset.
+
+    Falls back to regular static URL when assets were not built.
+    """
+    manifest = {}
+    if app.config.get('ASSETS_DIR'):
+        manifest = assets.load_manifest(app.config['ASSETS_DIR'])
+    if filename in manifest:
+        return url_for('assets_view', filename=manifest[filename])
+    return url_for('static', filename=filename)
+
+
+@app.template_global()
+def avatar_prefix():
+    """
+    Returns URL prefix of cached avatars, templates append user id.
+    """
+    return url_for('avatar_view', user_id=0)[:-1]
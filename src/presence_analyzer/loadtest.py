@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Load testing harness for the API.
+"""
+
+import math
+import time
+import random
+import socket
+import urllib2
+import logging
+import threading
+import multiprocessing
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+ENDPOINTS = {
+    'users': '/api/v1/users',
+    'mean_time_weekday': '/api/v1/mean_time_weekday/{0}',
+    'presence_weekday': '/api/v1/presence_weekday/{0}',
+    'mean_start_end': '/api/v1/mean_start_end/{0}',
+}
+
+DEFAULT_MIX = (
+    'users:1,mean_time_weekday:3,presence_weekday:3,mean_start_end:3'
+)
+
+
+def parse_mix(mix):
+    """
+    Parses 'endpoint:weight,...' into list of (endpoint, weight).
+    """
+    result = []
+    for item in mix.split(','):
+        endpoint, _, weight = item.strip().partition(':')
+        if endpoint not in ENDPOINTS:
+            raise ValueError('Unknown endpoint: {0}'.format(endpoint))
+        result.append((endpoint, float(weight or 1)))
+    return result
+
+
+def build_plan(user_ids, mix, requests, seed=0):
+    """
+    Returns list of (endpoint, path) drawn from weighted endpoint mix.
+    """
+    rand = random.Random(seed)
+    total = sum(weight for endpoint, weight in mix)
+    plan = []
+    for i in range(requests):
+        point = rand.uniform(0, total)
+        for endpoint, weight in mix:
+            point -= weight
+            if point <= 0:
+                break
+        plan.append((
+            endpoint, ENDPOINTS[endpoint].format(rand.choice(user_ids))
+        ))
+    return plan
+
+
+def percentile(values, fraction):
+    """
+    Returns percentile of sorted values using nearest rank.
+    """
+    if not values:
+        return 0
+    index = int(math.ceil(fraction * len(values))) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+def run_load(base_url, plan, concurrency, timeout=30):
+    """
+    Sends requests from plan using concurrent clients.
+
+    Returns dict with elapsed time and per endpoint latencies, errors
+    and client errors. Responses with status 4xx are counted as client
+    errors and left out of latencies, they are much faster than real
+    answers and would skew percentiles. Status 5xx and connection
+    failures are errors.
+    """
+    latencies = dict((endpoint, []) for endpoint, path in plan)
+    errors = dict((endpoint, 0) for endpoint, path in plan)
+    client_errors = dict((endpoint, 0) for endpoint, path in plan)
+    position = [0]
+    lock = threading.Lock()
+
+    def client():
+        """
+        Sends requests until plan is exhausted.
+        """
+        while True:
+            with lock:
+                if position[0] >= len(plan):
+                    return
+                endpoint, path = plan[position[0]]
+                position[0] += 1
+            start = time.time()
+            failed = client_error = False
+            try:
+                urllib2.urlopen(base_url + path, timeout=timeout).read()
+            except urllib2.HTTPError as error:
+                failed = error.code >= 500
+                client_error = 400 <= error.code < 500
+            except (urllib2.URLError, socket.error):
+                failed = True
+            elapsed = time.time() - start
+            with lock:
+                if client_error:
+                    client_errors[endpoint] += 1
+                    continue
+                latencies[endpoint].append(elapsed)
+                if failed:
+                    errors[endpoint] += 1
+
+    threads = [threading.Thread(target=client) for i in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        'elapsed': time.time() - start,
+        'latencies': latencies,
+        'errors': errors,
+        'client_errors': client_errors,
+    }
+
+
+def summarize(concurrency, result):
+    """
+    Returns report rows with throughput and latency percentiles.
+
+    Latencies are given in milliseconds, the last row covers all
+    endpoints. Requests and throughput include client errors.
+    """
+    rows = []
+    groups = sorted(result['latencies'].items())
+    everything = sum((values for endpoint, values in groups), [])
+    groups.append(('all', everything))
+    for endpoint, values in groups:
+        values = sorted(values)
+        if endpoint == 'all':
+            errors = sum(result['errors'].values())
+            client_errors = sum(result['client_errors'].values())
+        else:
+            errors = result['errors'][endpoint]
+            client_errors = result['client_errors'][endpoint]
+        requests = len(values) + client_errors
+        rows.append({
+            'concurrency': concurrency,
+            'endpoint': endpoint,
+            'requests': requests,
+            'errors': errors,
+            'client_errors': client_errors,
+            'rps': requests / result['elapsed'],
+            'p50': percentile(values, 0.50) * 1000,
+            'p95': percentile(values, 0.95) * 1000,
+            'p99': percentile(values, 0.99) * 1000,
+        })
+    return rows
+
+
+def format_rows(rows):
+    """
+    Formats report rows as a text table.
+    """
+    header = (
+        '{0:>5} {1:<18} {2:>8} {3:>6} {4:>6} {5:>8} {6:>9} {7:>9} {8:>9}'
+    )
+    lines = [header.format(
+        'conc', 'endpoint', 'requests', 'errors', '4xx', 'req/s',
+        'p50 ms', 'p95 ms', 'p99 ms'
+    )]
+    for row in rows:
+        lines.append(
+            '{concurrency:>5} {endpoint:<18} {requests:>8} {errors:>6} '
+            '{client_errors:>6} {rps:>8.1f} {p50:>9.1f} {p95:>9.1f} '
+            '{p99:>9.1f}'.format(**row)
+        )
+    return '\n'.join(lines)
+
+
+def serve(app, workers, spawn_if_under, max_requests, host, port, conn):
+    """
+    Runs Paste threadpool server and sends its port through conn.
+    """
+    import paste.httpserver
+    server = paste.httpserver.serve(
+        app, host=host, port=port, start_loop=False, use_threadpool=True,
+        threadpool_workers=workers,
+        threadpool_options={
+            'spawn_if_under': spawn_if_under,
+            'max_requests': max_requests,
+        },
+    )
+    conn.send(server.server_port)
+    conn.close()
+    server.serve_forever()
+
+
+def start_server(app, workers, spawn_if_under, max_requests,
+                 host='127.0.0.1', port=0, timeout=30):
+    """
+    Serves app on Paste threadpool server in a separate process.
+
+    Takes the same pool settings as etc/deploy.ini.in. The server must
+    not share the interpreter, and so the GIL, with client threads.
+    Returns the server process and its port.
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(
+        target=serve, name='loadtest-server',
+        args=(app, workers, spawn_if_under, max_requests, host, port, sender),
+    )
+    process.daemon = True
+    process.start()
+    sender.close()
+    if not receiver.poll(timeout):
+        process.terminate()
+        raise RuntimeError('Load test server did not start')
+    return process, receiver.recv()
@@ -4,5 +4,8 @@ Flask app initialization.
 """
 from flask import Flask
 
+from presence_analyzer.compress import CompressionMiddleware
+
 
 app = Flask(__name__)  # pylint: disable=invalid-name
+app.wsgi_app = CompressionMiddleware(app.wsgi_app, app.config)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Memory usage diagnostics.
+"""
+
+import gc
+import os
+import sys
+import types
+from collections import Counter
+
+from presence_analyzer.main import app
+from presence_analyzer import utils, storage
+
+# Shared objects which must not be counted into sizes of data structures.
+SKIPPED_TYPES = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+)
+
+
+def load_tracemalloc():
+    """
+    Returns tracemalloc module, None when it's not available.
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    return tracemalloc
+
+
+def deep_size(obj):
+    """
+    Returns approximate size in bytes of obj and objects it references.
+
+    Every object is counted once. Classes, modules and functions are
+    not counted.
+    """
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, SKIPPED_TYPES):
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        if hasattr(item, '__dict__'):
+            stack.append(item.__dict__)
+        for slot in getattr(type(item), '__slots__', ()):
+            if hasattr(item, slot):
+                stack.append(getattr(item, slot))
+    return size
+
+
+def cache_report():
+    """
+    Returns sizes of utils.cache entries.
+    """
+    return sorted(
+        [
+            {
+                'name': utils.cache_names.get(key, str(key)),
+                'size': deep_size(value),
+            }
+            for key, value in utils.cached_data.items()
+        ],
+        key=lambda entry: -entry['size']
+    )
+
+
+def structures_report():
+    """
+    Returns sizes of data structures held by the worker.
+    """
+    report = [
+        {
+            'name': 'data_from_xml',
+            'size': deep_size(utils.data_from_xml()),
+            'file_size': os.path.getsize(app.config['DATA_XML']),
+        },
+    ]
+    backend = storage.get_storage()
+    if isinstance(backend, storage.MemoryStorage):
+        # other backends don't keep presence data in get_data()
+        data = utils.get_data()
+        report.append({
+            'name': 'get_data',
+            'size': deep_size(data),
+            'users': len(data),
+            'days': sum(len(days) for days in data.values()),
+        })
+        report.append({
+            'name': 'memory_storage_stats',
+            'size': deep_size(backend.stats),
+        })
+    middleware = app.wsgi_app
+    if hasattr(middleware, 'cache'):
+        report.append({
+            'name': 'compression_cache',
+            'size': deep_size(middleware.cache),
+        })
+    return report
+
+
+def take_snapshot():
+    """
+    Takes tracemalloc snapshot when tracing, counts live objects otherwise.
+    """
+    tracemalloc = load_tracemalloc()
+    gc.collect()
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        return tracemalloc.take_snapshot()
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
+def compare_snapshots(before, after, limit=10):
+    """
+    Returns the biggest differences between two snapshots.
+
+    tracemalloc snapshots are compared by allocating line and give
+    size differences in bytes, object counts give count differences
+    by type.
+    """
+    if isinstance(before, Counter):
+        diff = Counter(after)
+        diff.subtract(before)
+        changes = sorted(
+            ((name, count) for name, count in diff.items() if count),
+            key=lambda change: -abs(change[1])
+        )
+        return [
+            {'type': name, 'count_diff': count}
+            for name, count in changes[:limit]
+        ]
+    return [
+        {
+            'location': str(stat.traceback),
+            'size_diff': stat.size_diff,
+            'count_diff': stat.count_diff,
+        }
+        for stat in after.compare_to(before, 'lineno')[:limit]
+    ]
+
+
+def reload_diff(limit=10):
+    """
+    Reloads data and returns memory differences it caused.
+    """
+    before = take_snapshot()
+    utils.bump_generation()
+    storage.get_storage().load()
+    utils.data_from_xml()
+    after = take_snapshot()
+    return compare_snapshots(before, after, limit)
+
+
+def memory_report(diff=False, limit=10):
+    """
+    Returns memory diagnostics report.
+    """
+    tracemalloc = load_tracemalloc()
+    # structures are loaded first, so they show up in the cache too
+    structures = structures_report()
+    report = {
+        'cache': cache_report(),
+        'structures': structures,
+        'tracing': bool(tracemalloc and tracemalloc.is_tracing()),
+    }
+    if diff:
+        report['reload_diff'] = reload_diff(limit)
+    return report
+
+
+def start_tracing():
+    """
+    Starts tracemalloc when it's available.
+    """
+    tracemalloc = load_tracemalloc()
+    if tracemalloc is not None and not tracemalloc.is_tracing():
+        tracemalloc.start()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Downloads data files over HTTP and swaps them in atomically.
+"""
+
+import os
+import json
+import time
+import socket
+import httplib
+import logging
+import tempfile
+import urllib2
+
+from lxml import etree
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ValidationError(Exception):
+    """
+    Downloaded file has unexpected content.
+    """
+
+
+def validate_users_xml(path):
+    """
+    Checks if path holds users XML with server and users sections.
+    """
+    try:
+        root = etree.parse(path).getroot()
+    except etree.XMLSyntaxError as error:
+        raise ValidationError('Invalid XML: {0}'.format(error))
+    if root.find('server') is None or root.find('users') is None:
+        raise ValidationError('Missing server or users element')
+
+
+def meta_path(path):
+    """
+    Returns path of the file keeping validators of downloaded file.
+    """
+    return path + '.meta'
+
+
+def load_meta(path):
+    """
+    Returns ETag, Last-Modified and Content-Type of the previous download.
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(meta_path(path), 'r') as metafile:
+            return json.load(metafile)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_meta(path, headers):
+    """
+    Stores ETag, Last-Modified and Content-Type of downloaded file.
+    """
+    meta = {}
+    if headers.get('Content-Type'):
+        meta['content_type'] = headers['Content-Type']
+    if headers.get('ETag'):
+        meta['etag'] = headers['ETag']
+    if headers.get('Last-Modified'):
+        meta['last_modified'] = headers['Last-Modified']
+    with open(meta_path(path), 'w') as metafile:
+        json.dump(meta, metafile)
+
+
+def download(url, path, validate=None, timeout=30):
+    """
+    Downloads url to path unless it was not modified since last time.
+
+    Body is streamed into a temporary file next to path, validated and
+    renamed over path, so readers never see a partial file.
+    Returns True when path was replaced.
+    """
+    meta = load_meta(path)
+    request = urllib2.Request(url)
+    if meta.get('etag'):
+        request.add_header('If-None-Match', meta['etag'])
+    if meta.get('last_modified'):
+        request.add_header('If-Modified-Since', meta['last_modified'])
+
+    try:
+        response = urllib2.urlopen(request, timeout=timeout)
+    except urllib2.HTTPError as error:
+        if error.code == 304:
+            log.info('%s not modified', url)
+            return False
+        raise
+
+    tmp = tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix='.' + os.path.basename(path),
+        delete=False,
+    )
+    try:
+        with tmp:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                tmp.write(chunk)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        if validate is not None:
+            validate(tmp.name)
+        os.chmod(tmp.name, 0o644)
+        os.rename(tmp.name, path)
+    except Exception:
+        os.unlink(tmp.name)
+        raise
+    finally:
+        response.close()
+
+    save_meta(path, response.info())
+    log.info('Downloaded %s to %s', url, path)
+    return True
+
+
+def download_with_retry(url, path, validate=None, retries=3, backoff=1.0,
+                        timeout=30):
+    """
+    Calls download() retrying network and server errors.
+
+    Waits backoff seconds before the first retry and doubles the delay
+    after each failed attempt.
+    """
+    delay = backoff
+    for attempt in range(retries + 1):
+        try:
+            return download(url, path, validate, timeout)
+        except urllib2.HTTPError as error:
+            if error.code < 500 or attempt == retries:
+                raise
+            log.warning('Download of %s failed: %s', url, error)
+        except (urllib2.URLError, httplib.HTTPException, socket.error,
+                ValidationError) as error:
+            if attempt == retries:
+                raise
+            log.warning('Download of %s failed: %s', url, error)
+        time.sleep(delay)
+        delay *= 2
@@ -4,12 +4,8 @@
 
 import os
 import sys
-import urllib2
 from functools import partial
 
-import paste.script.command
-import werkzeug.script
-
 etc = partial(os.path.join, 'parts', 'etc')
 
 DEPLOY_INI = etc('deploy.ini')
@@ -18,6 +14,8 @@ DEPLOY_CFG = etc('deploy.cfg')
 DEBUG_INI = etc('debug.ini')
 DEBUG_CFG = etc('debug.cfg')
 
+PREFORK_INI = etc('prefork.ini')
+
 _buildout_path = __file__
 for i in range(2 + __name__.count('.')):
     _buildout_path = os.path.dirname(_buildout_path)
@@ -28,12 +26,38 @@ del _buildout_path
 
 # bin/paster serve parts/etc/deploy.ini
 def make_app(global_conf={}, config=DEPLOY_CFG, debug=False):
+    app = load_app(config, debug)
+    _start_background(app)
+    return app
+
+
+def load_app(config=DEPLOY_CFG, debug=False):
+    """Configure the application without starting background threads.
+
+    Used by commands which don't serve requests.
+    """
     from presence_analyzer import app
     app.config.from_pyfile(abspath(config))
     app.debug = debug
     return app
 
 
+def _start_background(app, prefetch=True):
+    """Start data watcher, warm-up and prefetch threads enabled in config."""
+    if app.config.get('MEMORY_TRACEMALLOC'):
+        from presence_analyzer.memory import start_tracing
+        start_tracing()
+    if app.config.get('DATA_WATCH'):
+        from presence_analyzer.watcher import start_watcher
+        start_watcher(app)
+    if app.config.get('WARMUP'):
+        from presence_analyzer.warmup import start_warmup
+        start_warmup(app)
+    if prefetch and app.config.get('AVATAR_PREFETCH'):
+        from presence_analyzer.avatars import start_prefetch
+        start_prefetch()
+
+
 # bin/paster serve parts/etc/debug.ini
 def make_debug(global_conf={}, **conf):
     from werkzeug.debug import DebuggedApplication
@@ -41,20 +65,94 @@ def make_debug(global_conf={}, **conf):
     return DebuggedApplication(app, evalex=True)
 
 
+# bin/paster serve parts/etc/prefork.ini
+def make_prefork_app(global_conf={}, config=DEPLOY_CFG):
+    """Application for the prefork server.
+
+    Avatars are prefetched by the first worker, so the master neither
+    waits for downloads nor forks while they hold locks.
+    """
+    app = load_app(config)
+    _start_background(app, prefetch=False)
+    return app
+
+
+def make_prefork_server(global_conf={}, host='0.0.0.0', port='8080',
+                        worker_class='sync', workers='4', threads='1',
+                        worker_connections='1000', max_requests='0',
+                        timeout='30'):
+    """Serve the application with gunicorn worker processes.
+
+    'worker_class' selects the worker model: 'sync' pre-forked processes
+    handling one request at a time, 'gthread' processes with a thread
+    pool, or event loop processes with 'gevent' or 'eventlet'.
+    """
+    from gunicorn.app.base import BaseApplication
+    from presence_analyzer import app as flask_app, storage, avatars
+
+    def post_fork(server, worker):
+        # threads, locks and database connections don't survive fork
+        storage.reset()
+        avatars.reset()
+        _start_background(flask_app, prefetch=False)
+
+    def post_worker_init(worker):
+        # prefetch once, in the first worker, after gevent patched it
+        if worker.age == 1 and flask_app.config.get('AVATAR_PREFETCH'):
+            avatars.start_prefetch()
+
+    options = {
+        'bind': '%s:%s' % (host, port),
+        'worker_class': worker_class,
+        'workers': int(workers),
+        'threads': int(threads),
+        'worker_connections': int(worker_connections),
+        'max_requests': int(max_requests),
+        'timeout': int(timeout),
+        'post_fork': post_fork,
+        'post_worker_init': post_worker_init,
+    }
+
+    class PreforkServer(BaseApplication):
+
+        def __init__(self, application):
+            self.application = application
+            super(PreforkServer, self).__init__()
+
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+    def serve(app):
+        # forking while background threads hold locks would deadlock
+        # workers, so finish warm-up and let workers watch data files
+        from presence_analyzer import warmup, watcher
+        warmup.wait_warmup()
+        watcher.stop_watcher()
+        PreforkServer(app).run()
+    serve.options = options
+    return serve
+
+
 # bin/flask-ctl shell
 def make_shell():
     """Interactive Flask Shell"""
     from flask import request
-    app = make_app()
+    app = load_app()
     http = app.test_client()
     reqctx = app.test_request_context
     return locals()
 
 
-def _serve(action, debug=False, dry_run=False):
-    """Build paster command from 'action' and 'debug' flag."""
+def _serve(action, debug=False, dry_run=False, prefork=False):
+    """Build paster command from 'action', 'debug' and 'prefork' flags."""
     if debug:
         config = DEBUG_INI
+    elif prefork:
+        config = PREFORK_INI
     else:
         config = DEPLOY_INI
     argv = ['bin/paster', 'serve', config]
@@ -76,15 +174,17 @@ def _serve(action, debug=False, dry_run=False):
         ]
     sys.argv = argv[:2] + [abspath(config)] + argv[3:]
     # Run the 'paster' command
+    import paste.script.command
     paste.script.command.run()
 
 
 # bin/flask-ctl ...
 def run():
+    import werkzeug.script
     action_shell = werkzeug.script.make_shell(make_shell, make_shell.__doc__)
 
     # bin/flask-ctl serve [fg|start|stop|restart|status]
-    def action_serve(action=('a', 'start'), dry_run=False):
+    def action_serve(action=('a', 'start'), dry_run=False, prefork=False):
         """Serve the application.
 
         This command serves a web application that uses a paste.deploy
@@ -93,8 +193,9 @@ def run():
         Options:
          - 'action' is one of [fg|start|stop|restart|status]
          - '--dry-run' print the paster command and exit
+         - '--prefork' serve with gunicorn workers instead of threadpool
         """
-        _serve(action, debug=False, dry_run=dry_run)
+        _serve(action, debug=False, dry_run=dry_run, prefork=prefork)
 
     # bin/flask-ctl debug [fg|start|stop|restart|status]
     def action_debug(action=('a', 'start'), dry_run=False):
@@ -111,6 +212,151 @@ def run():
         """Stop the application."""
         _serve('stop', dry_run=dry_run)
 
+    # bin/flask-ctl formats
+    def action_formats(repeat=('r', 10)):
+        """Compare payload size and encoding time of API formats.
+
+        Encodes responses of every API endpoint for every user.
+        """
+        import json
+        from presence_analyzer import formats, storage
+        app = load_app()
+        http = app.test_client()
+        urls = ['/api/v1/users']
+        with app.app_context():
+            for user_id in storage.get_storage().user_ids():
+                for endpoint in ('mean_time_weekday', 'presence_weekday',
+                                 'mean_start_end'):
+                    urls.append('/api/v1/%s/%d' % (endpoint, user_id))
+        datasets = [json.loads(http.get(url).data) for url in urls]
+        results = formats.benchmark(
+            datasets, repeat, app.config.get('COMPRESS_LEVEL', 6))
+        json_size, json_gzip_size, json_time = results[0][1:]
+        print '%-50s %10s %10s %10s' % ('format', 'bytes', 'gzipped',
+                                        'ms/pass')
+        for mimetype, size, gzip_size, seconds in results:
+            print ('%-50s %10d %10d %10.2f  '
+                   '(%3.0f%% size, %3.0f%% gzipped, %3.0f%% time)') % (
+                mimetype, size, gzip_size, seconds * 1000,
+                100.0 * size / json_size, 100.0 * gzip_size / json_gzip_size,
+                100.0 * seconds / json_time)
+
+    # bin/flask-ctl export_static
+    def action_export_static(processes=('p', 0)):
+        """Export API responses to EXPORT_DIR.
+
+        Writes JSON and gzipped JSON of every endpoint for every user,
+        named after API URLs, to be served by a front web server.
+
+        Options:
+         - '--processes' number of worker processes, defaults to CPU count
+        """
+        from presence_analyzer.export import export_static
+        app = load_app()
+        export_dir = app.config['EXPORT_DIR']
+        count = export_static(export_dir, processes or None)
+        print 'Exported %d responses to %s' % (count, export_dir)
+
+    # bin/flask-ctl loadtest
+    def action_loadtest(url='', concurrency='1,10,50', requests=1000,
+                        mix=('m', ''), workers=50, spawn_if_under=5,
+                        max_requests=200):
+        """Measure throughput and latency of the API under load.
+
+        Starts the application on a Paste threadpool server with given
+        pool settings in a separate process, unless '--url' of a running
+        server is given, and requests API endpoints of users from
+        DATA_XML which have presence data.
+
+        Options:
+         - '--concurrency' comma separated numbers of concurrent clients
+         - '--requests' number of requests per concurrency level
+         - '--mix' endpoint weights, e.g. 'users:1,mean_start_end:3'
+         - '--workers', '--spawn-if-under', '--max-requests' pool settings
+        """
+        from presence_analyzer import loadtest, utils, storage
+        app = load_app()
+        with app.app_context():
+            # users without presence data only get fast 404 responses
+            with_data = set(storage.get_storage().user_ids())
+            user_ids = [
+                user['user_id'] for user in utils.data_from_xml()
+                if user['user_id'] in with_data
+            ]
+        plan_mix = loadtest.parse_mix(mix or loadtest.DEFAULT_MIX)
+        server = None
+        if not url:
+            server, port = loadtest.start_server(
+                app, workers, spawn_if_under, max_requests)
+            url = 'http://127.0.0.1:%d' % port
+        print 'Load testing %s' % url
+        rows = []
+        try:
+            for level in [int(x) for x in concurrency.split(',')]:
+                plan = loadtest.build_plan(user_ids, plan_mix, requests)
+                result = loadtest.run_load(url, plan, level)
+                rows.extend(loadtest.summarize(level, result))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.join()
+        print loadtest.format_rows(rows)
+
+    # bin/flask-ctl startup
+    def action_startup(repeat=3):
+        """Report cold start time of the application.
+
+        Times imports in fresh interpreters and loading the configuration.
+        """
+        import time
+        from presence_analyzer import startup
+        timings, loaded = startup.startup_report(repeat=repeat)
+        for module, seconds in timings:
+            print 'import %-30s %8.1f ms' % (module, seconds * 1000)
+        start = time.time()
+        load_app()
+        print 'load_app %-28s %8.1f ms' % ('', (time.time() - start) * 1000)
+        timing = dict(timings)
+        if 'flask' in timing and 'presence_analyzer' in timing:
+            print 'package overhead %-20s %8.1f ms' % (
+                '', (timing['presence_analyzer'] - timing['flask']) * 1000)
+        print 'overhead budget %-21s %8.1f ms' % (
+            '', startup.IMPORT_TIME_BUDGET * 1000)
+        if loaded:
+            print 'eagerly imported: %s' % ', '.join(loaded)
+
+    # bin/flask-ctl assets
+    def action_assets():
+        """Build fingerprinted and precompressed static assets."""
+        from presence_analyzer.assets import build_assets
+        app = load_app()
+        manifest = build_assets(app.static_folder, app.config['ASSETS_DIR'])
+        print 'Built %d assets in %s' % (
+            len(manifest), app.config['ASSETS_DIR'])
+
+    # bin/flask-ctl memory
+    def action_memory(diff=False, limit=10):
+        """Report memory used by caches and data structures.
+
+        With --diff data is reloaded and the biggest memory differences
+        are listed, by allocation site when tracemalloc is available and
+        by object type otherwise.
+        """
+        from presence_analyzer import memory
+        memory.start_tracing()
+        app = load_app()
+        with app.app_context():
+            report = memory.memory_report(diff=diff, limit=limit)
+        for entry in report['structures'] + report['cache']:
+            print '%-40s %12d bytes' % (entry['name'][:40], entry['size'])
+        if diff:
+            print 'reload differences (%s):' % (
+                'tracemalloc' if report['tracing'] else 'object counts')
+            for change in report['reload_diff']:
+                print '%-60s %+10d' % (
+                    change.get('location', change.get('type'))[:60],
+                    change.get('size_diff', change['count_diff']))
+
     werkzeug.script.run()
 
 
@@ -118,10 +364,13 @@ def get_xml_from_http():
     """
     Gets users XML file.
     """
-    app = make_app(config=DEPLOY_CFG)
-    xml_url = app.config['XML_URL']
-    xml_path = app.config['DATA_XML']
-    data = urllib2.urlopen(xml_url)
-
-    with open(xml_path, 'w') as filename:
-        filename.write(data.read())
+    from presence_analyzer.refresh import download_with_retry
+    from presence_analyzer.refresh import validate_users_xml
+    app = load_app(config=DEPLOY_CFG)
+    download_with_retry(
+        app.config['XML_URL'],
+        app.config['DATA_XML'],
+        validate=validate_users_xml,
+        retries=app.config.get('XML_RETRIES', 3),
+        backoff=app.config.get('XML_RETRY_BACKOFF', 1.0),
+    )
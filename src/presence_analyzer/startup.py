@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Measures cold start time of the application.
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+# Seconds a cold import of the package may take on top of importing
+# flask, see import_overhead() and tests.
+IMPORT_TIME_BUDGET = float(
+    os.environ.get('PRESENCE_ANALYZER_IMPORT_BUDGET', '0.025')
+)
+
+# Modules which should be imported only when they are used.
+LAZY_MODULES = [
+    'lxml.etree',
+    'csv',
+    'sqlite3',
+    'msgpack',
+    'gzip',
+    'pyinotify',
+    'paste.script.command',
+    'werkzeug.script',
+    'presence_analyzer.refresh',
+    'presence_analyzer.export',
+    'presence_analyzer.loadtest',
+    'presence_analyzer.memory',
+]
+
+MEASURE_SCRIPT = """
+import sys, json, time
+start = time.time()
+import {0}
+elapsed = time.time() - start
+print(json.dumps({{
+    'module': '{0}',
+    'seconds': elapsed,
+    'modules': sorted(name for name in sys.modules if sys.modules[name]),
+}}))
+"""
+
+
+def measure_import(module, python=None):
+    """
+    Imports module in a fresh interpreter.
+
+    Returns dict with import time in seconds and names of loaded modules.
+    """
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [src_dir] + [path for path in sys.path if path]
+    )
+    output = subprocess.check_output(
+        [python or sys.executable, '-c', MEASURE_SCRIPT.format(module)],
+        env=env,
+    )
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_overhead(repeat=3):
+    """
+    Returns seconds a cold import of the package adds to importing flask.
+
+    Best of repeat imports is taken, which makes it comparable between
+    machines of different speed.
+    """
+    package = min(
+        measure_import('presence_analyzer')['seconds']
+        for i in range(repeat)
+    )
+    flask = min(measure_import('flask')['seconds'] for i in range(repeat))
+    return package - flask
+
+
+def startup_report(modules=None, repeat=3):
+    """
+    Returns (module, best seconds of repeat cold imports) pairs and
+    names of lazy modules loaded by importing the package.
+    """
+    modules = modules or ['flask', 'presence_analyzer']
+    timings = []
+    loaded = []
+    for module in modules:
+        results = [measure_import(module) for i in range(repeat)]
+        timings.append((module, min(r['seconds'] for r in results)))
+        if module == 'presence_analyzer':
+            loaded = [
+                name for name in LAZY_MODULES
+                if name in results[0]['modules']
+            ]
+    return timings, loaded
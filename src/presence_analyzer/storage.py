@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+Presence data storage backends.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+from presence_analyzer.main import app
+from presence_analyzer import utils
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# Size of chunks in which the imported part of the CSV is hashed.
+CHUNK_SIZE = 64 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS presence (
+    user_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    PRIMARY KEY (user_id, date)
+);
+CREATE INDEX IF NOT EXISTS presence_date ON presence (date);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# strftime('%w') counts from Sunday, date.weekday() counts from Monday.
+WEEKDAY_STATS_QUERY = """
+SELECT
+    (CAST(strftime('%w', date) AS INTEGER) + 6) % 7 AS weekday,
+    COUNT(*),
+    SUM(end - start),
+    SUM(start),
+    SUM(end)
+FROM presence
+WHERE user_id = ?
+GROUP BY weekday
+"""
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def empty_stats():
+    """
+    Creates empty per weekday statistics.
+    """
+    return [
+        {'count': 0, 'total': 0, 'start': 0, 'end': 0}
+        for x in range(0, 7)
+    ]
+
+
+class MemoryStorage(object):
+    """
+    Answers queries from the structure returned by utils.get_data().
+
+    Computed statistics are kept until get_data() returns new data.
+    """
+
+    def __init__(self):
+        self.data = None
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Loads presence data.
+        """
+        utils.get_data()
+
+    def weekday_stats(self, user_id):
+        """
+        Returns presence statistics of given user grouped by weekday.
+
+        Every weekday holds number of entries, total presence time and
+        sums of start and end times in seconds since midnight.
+        Returns None for unknown users.
+        """
+        data = utils.get_data()
+        with self.lock:
+            if data is not self.data:
+                self.data = data
+                self.stats = {}
+            if user_id in self.stats:
+                return self.stats[user_id]
+
+        if user_id not in data:
+            return None
+
+        result = empty_stats()
+        for date, item in data[user_id].iteritems():
+            start = utils.seconds_since_midnight(item['start'])
+            end = utils.seconds_since_midnight(item['end'])
+            stats = result[date.weekday()]
+            stats['count'] += 1
+            stats['total'] += end - start
+            stats['start'] += start
+            stats['end'] += end
+
+        with self.lock:
+            if data is self.data:
+                self.stats[user_id] = result
+        return result
+
+    def user_ids(self):
+        """
+        Returns ids of users with presence data.
+        """
+        return utils.get_data().keys()
+
+
+class SQLiteStorage(object):
+    """
+    Keeps presence data in an indexed SQLite database.
+
+    The CSV file is imported incrementally: rows appended since the last
+    import are added, any other change of the file rebuilds the database.
+    Every thread uses its own connection.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def connection(self):
+        """
+        Returns database connection of the current thread.
+        """
+        conn = getattr(self.local, 'connection', None)
+        if conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.db_path)
+            conn.executescript(SCHEMA)
+            self.local.connection = conn
+        return conn
+
+    def load(self):
+        """
+        Imports new rows of the CSV file.
+
+        Rows are kept only in the database, not in utils.get_data().
+        """
+        self.refresh(app.config['DATA_CSV'])
+
+    def get_meta(self, conn):
+        """
+        Returns import metadata stored in the database.
+        """
+        return dict(conn.execute('SELECT key, value FROM meta'))
+
+    def refresh(self, csv_path):
+        """
+        Imports rows of the CSV file which are not in the database yet.
+        """
+        stat = os.stat(csv_path)
+        conn = self.connection()
+        with self.lock:
+            meta = self.get_meta(conn)
+            if (meta.get('csv_path') == csv_path and
+                    meta.get('mtime') == repr(stat.st_mtime) and
+                    meta.get('size') == str(stat.st_size)):
+                return
+
+            with open(csv_path, 'rb') as csvfile:
+                offset = int(meta.get('offset', 0))
+                digest = self.prefix_digest(csvfile, offset)
+                if (meta.get('csv_path') != csv_path or
+                        offset > stat.st_size or
+                        meta.get('fingerprint') != digest.hexdigest()):
+                    log.info('Rebuilding presence database from %s', csv_path)
+                    conn.execute('DELETE FROM presence')
+                    offset = 0
+                    digest = hashlib.md5()
+                csvfile.seek(offset)
+                offset = self.import_rows(conn, csvfile, offset, digest)
+
+            conn.executemany(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                [
+                    ('csv_path', csv_path),
+                    ('mtime', repr(stat.st_mtime)),
+                    ('size', str(stat.st_size)),
+                    ('offset', str(offset)),
+                    ('fingerprint', digest.hexdigest()),
+                ]
+            )
+            conn.commit()
+
+    @staticmethod
+    def prefix_digest(csvfile, length):
+        """
+        Returns md5 of the first length bytes of csvfile.
+
+        The whole imported part is hashed, so an edit of any imported row
+        rebuilds the database instead of being taken for an append.
+        """
+        digest = hashlib.md5()
+        csvfile.seek(0)
+        while length > 0:
+            chunk = csvfile.read(min(length, CHUNK_SIZE))
+            if not chunk:
+                break
+            digest.update(chunk)
+            length -= len(chunk)
+        return digest
+
+    def import_rows(self, conn, csvfile, offset, digest):
+        """
+        Imports complete lines from csvfile and returns new offset.
+
+        Imported lines are added to digest of the imported part.
+        """
+        import csv
+        rows = []
+        for line in csvfile:
+            if not line.endswith('\n'):
+                # line is still being written
+                break
+            offset += len(line)
+            digest.update(line)
+            row = next(csv.reader([line], delimiter=','), [])
+            if len(row) != 4:
+                # ignore header and footer lines
+                continue
+
+            try:
+                rows.append((
+                    int(row[0]),
+                    datetime.strptime(row[1], '%Y-%m-%d').date().isoformat(),
+                    utils.seconds_since_midnight(
+                        datetime.strptime(row[2], '%H:%M:%S').time()
+                    ),
+                    utils.seconds_since_midnight(
+                        datetime.strptime(row[3], '%H:%M:%S').time()
+                    ),
+                ))
+            except (ValueError, TypeError):
+                log.debug('Problem with line: %r', line, exc_info=True)
+
+        conn.executemany(
+            'INSERT OR REPLACE INTO presence (user_id, date, start, end) '
+            'VALUES (?, ?, ?, ?)',
+            rows
+        )
+        return offset
+
+    def user_ids(self):
+        """
+        Returns ids of users with presence data.
+        """
+        self.refresh(app.config['DATA_CSV'])
+        return [
+            user_id for user_id, in self.connection().execute(
+                'SELECT DISTINCT user_id FROM presence'
+            )
+        ]
+
+    def weekday_stats(self, user_id):
+        """
+        Returns presence statistics of given user grouped by weekday.
+
+        See MemoryStorage.weekday_stats().
+        """
+        self.refresh(app.config['DATA_CSV'])
+        rows = self.connection().execute(
+            WEEKDAY_STATS_QUERY, (user_id,)
+        ).fetchall()
+        if not rows:
+            return None
+
+        result = empty_stats()
+        for weekday, count, total, start, end in rows:
+            result[weekday] = {
+                'count': count,
+                'total': total,
+                'start': start,
+                'end': end,
+            }
+        return result
+
+
+def get_storage():
+    """
+    Returns storage backend selected by STORAGE config option.
+    """
+    backend = app.config.get('STORAGE', 'memory')
+    if backend == 'memory':
+        key = (backend,)
+    elif backend == 'sqlite':
+        key = (backend, app.config['DATA_DB'])
+    else:
+        raise ValueError('Unknown storage backend: {0}'.format(backend))
+
+    with _storages_lock:
+        if key not in _storages:
+            if backend == 'memory':
+                _storages[key] = MemoryStorage()
+            else:
+                _storages[key] = SQLiteStorage(app.config['DATA_DB'])
+        return _storages[key]
+
+
+def reset():
+    """
+    Drops storage backend instances.
+
+    Forked processes must call it before using storage, so they don't
+    share database connections with their parent.
+    """
+    with _storages_lock:
+        _storages.clear()
@@ -3,11 +3,31 @@
 Presence analyzer unit tests.
 """
 import os.path
+import gzip
+import sys
 import json
+import zlib
+import urllib2
+import BaseHTTPServer
+import shutil
 import datetime
+import tempfile
+import StringIO
+import threading
+import logging
 import unittest
 
-from presence_analyzer import main, views, utils
+from werkzeug.serving import make_server
+
+from presence_analyzer import (
+    main, views, utils, storage, watcher, warmup, refresh, compress, assets,
+    formats, export, loadtest, startup, avatars, memory, script,
+)
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # pragma: no cover
+    BaseApplication = None  # pylint: disable=invalid-name
 
 
 TEST_DATA_CSV = os.path.join(
@@ -31,6 +51,7 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
         """
         main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
         main.app.config.update({'DATA_XML': TEST_DATA_XML})
+        main.app.config.update({'STORAGE': 'memory'})
         self.client = main.app.test_client()
 
     def tearDown(self):
@@ -137,11 +158,295 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
             [u'Fri', 0, 0], [u'Sat', 0, 0],
             [u'Sun', 0, 0]])
 
+    def test_api_etag(self):
+        """
+        Test revalidating API responses until data is reloaded.
+        """
+        resp = self.client.get('/api/v1/mean_start_end/10')
+        etag = resp.headers['ETag']
+        resp = self.client.get(
+            '/api/v1/mean_start_end/10', headers={'If-None-Match': etag}
+        )
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, '')
+        self.assertEqual(resp.headers['ETag'], etag)
+        self.assertIn('Accept', resp.headers['Vary'])
+
+        resp = self.client.get(
+            '/api/v1/presence_weekday/10', headers={'If-None-Match': etag}
+        )
+        self.assertEqual(resp.status_code, 200)
+        resp = self.client.get(
+            '/api/v1/mean_start_end/10',
+            headers={'If-None-Match': etag, 'Accept': formats.COLUMNAR}
+        )
+        self.assertEqual(resp.status_code, 200)
 
+        gzip_etag = etag[:-1] + '-gzip"'
+        resp = self.client.get(
+            '/api/v1/mean_start_end/10',
+            headers={'Accept-Encoding': 'gzip', 'If-None-Match': gzip_etag}
+        )
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.headers['ETag'], gzip_etag)
 
-class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
+        utils.bump_generation()
+        resp = self.client.get(
+            '/api/v1/mean_start_end/10', headers={'If-None-Match': etag}
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+
+class PresenceAnalyzerSQLiteViewsTestCase(PresenceAnalyzerViewsTestCase):
     """
-    Utility functions tests.
+    Views tests against SQLite storage backend.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        super(PresenceAnalyzerSQLiteViewsTestCase, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        main.app.config.update({'STORAGE': 'sqlite'})
+        main.app.config.update({
+            'DATA_DB': os.path.join(self.tmp_dir, 'presence.sqlite'),
+        })
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.config.update({'STORAGE': 'memory'})
+        shutil.rmtree(self.tmp_dir)
+
+
+class PresenceAnalyzerStorageTestCase(unittest.TestCase):
+    """
+    Storage backends tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.tmp_dir, 'data.csv')
+        shutil.copy(TEST_DATA_CSV, self.csv_path)
+        main.app.config.update({'DATA_CSV': self.csv_path})
+        main.app.config.update({
+            'DATA_DB': os.path.join(self.tmp_dir, 'presence.sqlite'),
+        })
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.config.update({'STORAGE': 'memory'})
+        main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+        shutil.rmtree(self.tmp_dir)
+        utils.bump_generation()
+
+    def test_get_storage(self):
+        """
+        Test selecting storage backend from config.
+        """
+        main.app.config.update({'STORAGE': 'memory'})
+        self.assertIsInstance(storage.get_storage(), storage.MemoryStorage)
+        main.app.config.update({'STORAGE': 'sqlite'})
+        self.assertIsInstance(storage.get_storage(), storage.SQLiteStorage)
+        self.assertIs(storage.get_storage(), storage.get_storage())
+        main.app.config.update({'STORAGE': 'nosql'})
+        self.assertRaises(ValueError, storage.get_storage)
+
+    def test_weekday_stats(self):
+        """
+        Test if both backends compute the same statistics.
+        """
+        main.app.config.update({'STORAGE': 'sqlite'})
+        sqlite_stats = storage.get_storage().weekday_stats(10)
+        memory_stats = storage.MemoryStorage().weekday_stats(10)
+        self.assertEqual(sqlite_stats, memory_stats)
+        self.assertEqual(sqlite_stats[1], {
+            'count': 1,
+            'total': 30047,
+            'start': 34745,
+            'end': 64792,
+        })
+        self.assertIsNone(storage.get_storage().weekday_stats(1))
+
+    def test_sqlite_incremental_refresh(self):
+        """
+        Test importing rows appended to the CSV file.
+        """
+        main.app.config.update({'STORAGE': 'sqlite'})
+        sqlite_storage = storage.get_storage()
+        self.assertIsNone(sqlite_storage.weekday_stats(12))
+
+        with open(self.csv_path, 'a') as csvfile:
+            csvfile.write('12,2013-09-16,09:00:00,17:00:00\n')
+            csvfile.write('12,2013-09-17,09:00')
+        stats = sqlite_storage.weekday_stats(12)
+        self.assertEqual(stats[0]['total'], 8 * 3600)
+        self.assertEqual(stats[1]['count'], 0)
+
+        with open(self.csv_path, 'a') as csvfile:
+            csvfile.write(':00,16:00:00\n')
+        stats = sqlite_storage.weekday_stats(12)
+        self.assertEqual(stats[1]['total'], 7 * 3600)
+
+    def test_sqlite_edit_and_append(self):
+        """
+        Test rebuilding database when an imported row far in the file
+        changes and rows are appended at the same time.
+        """
+        main.app.config.update({'STORAGE': 'sqlite'})
+        day = datetime.date(2013, 1, 7)
+        rows = []
+        for i in range(200):
+            rows.append('12,{0},09:00:00,17:00:00\n'.format(
+                day + datetime.timedelta(days=i)
+            ))
+        with open(self.csv_path, 'w') as csvfile:
+            csvfile.write(''.join(rows))
+        self.assertGreater(os.path.getsize(self.csv_path), 4096)
+        sqlite_storage = storage.get_storage()
+        self.assertIsNotNone(sqlite_storage.weekday_stats(12))
+
+        rows[-1] = rows[-1].replace('17:00:00', '23:59:59')
+        rows.append('12,{0},09:00:00,17:00:00\n'.format(
+            day + datetime.timedelta(days=200)
+        ))
+        with open(self.csv_path, 'w') as csvfile:
+            csvfile.write(''.join(rows))
+        utils.bump_generation()
+        self.assertEqual(
+            sqlite_storage.weekday_stats(12),
+            storage.MemoryStorage().weekday_stats(12)
+        )
+
+    def test_sqlite_rebuild(self):
+        """
+        Test rebuilding database when the CSV file is replaced.
+        """
+        main.app.config.update({'STORAGE': 'sqlite'})
+        sqlite_storage = storage.get_storage()
+        self.assertIsNotNone(sqlite_storage.weekday_stats(10))
+
+        with open(self.csv_path, 'w') as csvfile:
+            csvfile.write('12,2013-09-16,09:00:00,17:00:00\n')
+        self.assertIsNone(sqlite_storage.weekday_stats(10))
+        self.assertIsNotNone(sqlite_storage.weekday_stats(12))
+
+
+class PresenceAnalyzerWatcherTestCase(unittest.TestCase):
+    """
+    Data files watcher tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'data.csv')
+        with open(self.path, 'w') as csvfile:
+            csvfile.write('10,2013-09-10,09:39:05,17:59:52\n')
+        self.calls = []
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def append_line(self):
+        """
+        Appends a line to watched file.
+        """
+        with open(self.path, 'a') as csvfile:
+            csvfile.write('10,2013-09-11,09:19:52,16:07:37\n')
+
+    def test_file_state(self):
+        """
+        Test describing file versions.
+        """
+        state = watcher.file_state(self.path)
+        self.assertEqual(state, watcher.file_state(self.path))
+        self.append_line()
+        self.assertNotEqual(state, watcher.file_state(self.path))
+        self.assertIsNone(watcher.file_state(self.path + '.missing'))
+
+    def test_debounce(self):
+        """
+        Test if a burst of changes triggers a single callback.
+        """
+        file_watcher = watcher.FileWatcher(
+            [self.path], lambda: self.calls.append(1),
+            debounce=60, use_inotify=False,
+        )
+        file_watcher.check()
+        self.assertEqual(self.calls, [])
+        self.append_line()
+        file_watcher.check()
+        self.append_line()
+        file_watcher.check()
+        self.assertEqual(self.calls, [])
+
+        file_watcher.debounce = 0
+        file_watcher.check()
+        self.assertEqual(self.calls, [1])
+        file_watcher.check()
+        self.assertEqual(self.calls, [1])
+
+    def test_watcher_thread(self):
+        """
+        Test if running watcher notices file replacement.
+        """
+        event = threading.Event()
+        file_watcher = watcher.FileWatcher(
+            [self.path], event.set, interval=0.05, debounce=0.05,
+        )
+        file_watcher.start()
+        try:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as csvfile:
+                csvfile.write('11,2013-09-05,09:28:08,15:51:27\n')
+            os.rename(tmp_path, self.path)
+            self.assertTrue(event.wait(5))
+        finally:
+            file_watcher.stop()
+            file_watcher.join(5)
+        self.assertFalse(file_watcher.is_alive())
+
+    def test_reload_sqlite(self):
+        """
+        Test if reload with SQLite storage keeps CSV out of the cache.
+        """
+        main.app.config.update({
+            'STORAGE': 'sqlite',
+            'DATA_CSV': self.path,
+            'DATA_DB': os.path.join(self.tmp_dir, 'presence.sqlite'),
+        })
+        key = hash('get_data' + repr(()) + repr({}))
+        try:
+            utils.cached_data.pop(key, None)
+            watcher.reload_data()
+            self.assertNotIn(key, utils.cached_data)
+            self.append_line()
+            watcher.reload_data()
+            self.assertEqual(
+                storage.get_storage().weekday_stats(10)[2]['count'], 1
+            )
+        finally:
+            main.app.config.update({'STORAGE': 'memory'})
+            main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+
+
+class PresenceAnalyzerWarmupTestCase(unittest.TestCase):
+    """
+    Warm-up and health checks tests.
     """
 
     def setUp(self):
@@ -150,83 +455,1177 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         """
         main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
         main.app.config.update({'DATA_XML': TEST_DATA_XML})
+        main.app.config.update({'STORAGE': 'memory'})
+        self.client = main.app.test_client()
 
     def tearDown(self):
         """
         Get rid of unused objects after each test.
         """
+        warmup.state.update({
+            'enabled': False,
+            'running': False,
+            'ready': False,
+            'started': None,
+            'finished': None,
+            'steps': [],
+        })
+
+    def test_healthz(self):
+        """
+        Test liveness check.
+        """
+        resp = self.client.get('/healthz')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.data)['status'], 'ok')
+
+    def test_ready_without_warmup(self):
+        """
+        Test if worker without warm-up is ready.
+        """
+        resp = self.client.get('/readyz')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(json.loads(resp.data)['ready'])
+
+    def test_warmup(self):
+        """
+        Test running warm-up steps.
+        """
+        warmup.state['enabled'] = True
+        resp = self.client.get('/readyz')
+        self.assertEqual(resp.status_code, 503)
+
+        warmup.run_warmup(main.app)
+        resp = self.client.get('/readyz')
+        self.assertEqual(resp.status_code, 200)
+        data = json.loads(resp.data)
+        self.assertTrue(data['ready'])
+        self.assertEqual(
+            [step['name'] for step in data['steps']],
+            ['presence', 'users', 'aggregates']
+        )
+        self.assertTrue(all(
+            step['status'] == 'done' and step['duration'] >= 0
+            for step in data['steps']
+        ))
+        self.assertIn('duration', data)
+
+    def test_warmup_sqlite(self):
+        """
+        Test if warm-up with SQLite storage keeps CSV out of the cache.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        main.app.config.update({'STORAGE': 'sqlite'})
+        main.app.config.update({
+            'DATA_DB': os.path.join(tmp_dir, 'presence.sqlite'),
+        })
+        key = hash('get_data' + repr(()) + repr({}))
+        try:
+            utils.cached_data.pop(key, None)
+            warmup.run_warmup(main.app)
+            self.assertTrue(warmup.status()['ready'])
+            self.assertNotIn(key, utils.cached_data)
+        finally:
+            main.app.config.update({'STORAGE': 'memory'})
+            shutil.rmtree(tmp_dir)
+
+    def test_warmup_failure(self):
+        """
+        Test if failed warm-up keeps worker out of rotation.
+        """
+        def broken():
+            """
+            Fails.
+            """
+            raise IOError('missing file')
+
+        warmup.run_warmup(main.app, [('broken', broken)])
+        resp = self.client.get('/readyz')
+        self.assertEqual(resp.status_code, 503)
+        data = json.loads(resp.data)
+        self.assertEqual(data['steps'][0]['status'], 'failed')
+
+    def test_start_warmup(self):
+        """
+        Test running warm-up in background.
+        """
+        event = threading.Event()
+        thread = warmup.start_warmup(main.app, [('wait', event.wait)])
+        self.assertIsNone(warmup.start_warmup(main.app))
+        self.assertFalse(warmup.status()['ready'])
+        event.set()
+        thread.join(5)
+        self.assertTrue(warmup.status()['ready'])
+        self.assertIsNone(warmup.start_warmup(main.app))
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves responses queued on the server, then the default response.
+    """
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Handles GET request.
+        """
+        self.server.requests.append(dict(self.headers))
+        if self.server.queue:
+            status, body = self.server.queue.pop(0)
+        else:
+            status, body = 200, self.server.body
+        if status == 200 and self.headers.get('If-None-Match') == '"v1"':
+            status, body = 304, ''
+        self.send_response(status)
+        if status == 200:
+            self.send_header('ETag', '"v1"')
+            if getattr(self.server, 'content_type', None):
+                self.send_header('Content-Type', self.server.content_type)
+            self.send_header(
+                'Last-Modified', 'Tue, 10 Sep 2013 10:00:00 GMT'
+            )
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """
+        Keeps test output clean.
+        """
         pass
 
-    def test_get_data(self):
+
+class PresenceAnalyzerRefreshTestCase(unittest.TestCase):
+    """
+    Users XML refresh tests.
+    """
+
+    def setUp(self):
         """
-        Test parsing of CSV file.
+        Before each test, set up a environment.
         """
-        data = utils.get_data()
-        self.assertIsInstance(data, dict)
-        self.assertItemsEqual(data.keys(), [10, 11])
-        sample_date = datetime.date(2013, 9, 10)
-        self.assertIn(sample_date, data[10])
-        self.assertItemsEqual(data[10][sample_date].keys(), ['start', 'end'])
+        self.server = BaseHTTPServer.HTTPServer(
+            ('127.0.0.1', 0), StandInHandler
+        )
+        with open(TEST_DATA_XML, 'r') as xmlfile:
+            self.server.body = xmlfile.read()
+        self.server.queue = []
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{0}/users.xml'.format(
+            self.server.server_port
+        )
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'users.xml')
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def download(self, **kwargs):
+        """
+        Downloads users XML from stand-in server.
+        """
+        return refresh.download_with_retry(
+            self.url, self.path, refresh.validate_users_xml,
+            backoff=0, **kwargs
+        )
+
+    def test_download(self):
+        """
+        Test downloading and conditional refresh.
+        """
+        self.assertTrue(self.download())
+        with open(self.path, 'r') as xmlfile:
+            self.assertEqual(xmlfile.read(), self.server.body)
+        self.assertNotIn('if-none-match', self.server.requests[0])
+
+        self.assertFalse(self.download())
+        self.assertEqual(self.server.requests[1]['if-none-match'], '"v1"')
         self.assertEqual(
-            data[10][sample_date]['start'],
-            datetime.time(9, 39, 5)
+            self.server.requests[1]['if-modified-since'],
+            'Tue, 10 Sep 2013 10:00:00 GMT'
+        )
+        self.assertItemsEqual(
+            os.listdir(self.tmp_dir), ['users.xml', 'users.xml.meta']
         )
 
-    def test_seconds_since_midnight(self):
+    def test_retry(self):
         """
-        Test if seconds are computed correctly.
+        Test retrying server errors.
         """
-        data = utils.seconds_since_midnight(datetime.time(1, 2, 3))
-        self.assertEqual(data, 3723)
+        self.server.queue = [(503, 'busy'), (500, 'error')]
+        self.assertTrue(self.download(retries=2))
+        self.assertEqual(len(self.server.requests), 3)
 
-    def test_interval(self):
+        self.server.queue = [(503, 'busy'), (503, 'busy')]
+        os.unlink(self.path)
+        with self.assertRaises(urllib2.HTTPError):
+            self.download(retries=1)
+        self.assertFalse(os.path.exists(self.path))
+
+        self.server.queue = [(404, 'not found')]
+        with self.assertRaises(urllib2.HTTPError):
+            self.download(retries=3)
+        self.assertEqual(len(self.server.requests), 6)
+
+    def test_invalid_body(self):
         """
-        Test if interval is computed correctly.
+        Test if invalid download keeps previous file.
         """
-        start = datetime.time(1)
-        end = datetime.time(1, 2, 3)
-        data = utils.interval(start, end)
-        self.assertEqual(data, 123)
+        with open(self.path, 'w') as xmlfile:
+            xmlfile.write(self.server.body)
+        self.server.queue = [(200, '<intranet><users>')]
+        with self.assertRaises(refresh.ValidationError):
+            self.download(retries=0)
+        with open(self.path, 'r') as xmlfile:
+            self.assertEqual(xmlfile.read(), self.server.body)
+        self.assertEqual(os.listdir(self.tmp_dir), ['users.xml'])
 
-    def test_mean(self):
+
+class PresenceAnalyzerCompressionTestCase(unittest.TestCase):
+    """
+    Response compression tests.
+    """
+
+    def setUp(self):
         """
-        Test calculation of arithmetic mean.
+        Before each test, set up a environment.
         """
-        self.assertEqual(utils.mean([0]), 0)
-        self.assertEqual(utils.mean(range(1, 10)), 5.)
-        self.assertEqual(utils.mean(range(1, 5)), 2.5)
-        self.assertIsInstance(utils.mean([0]), float)
+        main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+        main.app.config.update({'DATA_XML': TEST_DATA_XML})
+        main.app.config.update({'STORAGE': 'memory'})
+        main.app.config.update({'COMPRESS_MIN_SIZE': 100})
+        self.client = main.app.test_client()
 
-    def test_group_by_weekday(self):
+    def tearDown(self):
         """
-        Test if function correctly groups by weekdays.
+        Get rid of unused objects after each test.
         """
-        data = utils.get_data()
-        li = [[], [30047], [24465], [23705], [], [], []]
-        self.assertEqual(utils.group_by_weekday(data[10]), li)
+        main.app.config.pop('COMPRESS_MIN_SIZE')
 
-    def test_cache(self):
+    def test_accepted_encoding(self):
         """
-        Tests cache functionality.
+        Test choosing encoding from Accept-Encoding header.
         """
-        decorator = utils.cache(utils.get_data())
-        data = decorator.func_globals['cached_data']
-        result = [v for k, v in data.items()]
-        expected = {
-            datetime.date(2013, 9, 10): {
-                'end': datetime.time(17, 59, 52),
-                'start': datetime.time(9, 39, 5)
-                },
-            datetime.date(2013, 9, 11): {
-                'end': datetime.time(16, 7, 37),
-                'start': datetime.time(9, 19, 52)
-                },
-            datetime.date(2013, 9, 12): {
-                'end': datetime.time(17, 23, 51),
-                'start': datetime.time(10, 48, 46)
-                },
+        self.assertEqual(compress.accepted_encoding('gzip, deflate'), 'gzip')
+        self.assertEqual(compress.accepted_encoding('deflate'), 'deflate')
+        self.assertEqual(
+            compress.accepted_encoding('gzip;q=0, deflate;q=0.5'), 'deflate'
+        )
+        self.assertEqual(compress.accepted_encoding('*'), 'gzip')
+        self.assertIsNone(compress.accepted_encoding(''))
+        self.assertIsNone(compress.accepted_encoding('br, identity'))
+
+    def test_gzip(self):
+        """
+        Test gzip compressed responses.
+        """
+        plain = self.client.get('/api/v1/mean_start_end/10')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(plain.headers['Vary'], 'Accept, Accept-Encoding')
+
+        resp = self.client.get(
+            '/api/v1/mean_start_end/10',
+            headers={'Accept-Encoding': 'gzip'}
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(
+            int(resp.headers['Content-Length']), len(resp.data)
+        )
+        body = gzip.GzipFile(fileobj=StringIO.StringIO(resp.data)).read()
+        self.assertEqual(body, plain.data)
+
+    def test_vendor_json(self):
+        """
+        Test compressing columnar JSON responses.
+        """
+        self.assertTrue(compress.is_compressible_type(
+            formats.COLUMNAR + '; charset=utf-8'
+        ))
+        self.assertFalse(compress.is_compressible_type('image/png'))
+        resp = self.client.get(
+            '/api/v1/users',
+            headers={
+                'Accept': formats.COLUMNAR,
+                'Accept-Encoding': 'gzip',
             }
-        self.assertEqual(expected, result[0][10])
+        )
+        self.assertEqual(resp.headers['Content-Type'], formats.COLUMNAR)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+
+    def test_deflate(self):
+        """
+        Test deflate compressed responses.
+        """
+        plain = self.client.get('/presence_weekday.html')
+        resp = self.client.get(
+            '/presence_weekday.html', headers={'Accept-Encoding': 'deflate'}
+        )
+        self.assertEqual(resp.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(resp.data), plain.data)
+
+    def test_small_response(self):
+        """
+        Test if small responses are not compressed.
+        """
+        main.app.config.update({'COMPRESS_MIN_SIZE': 10000})
+        resp = self.client.get(
+            '/api/v1/users', headers={'Accept-Encoding': 'gzip'}
+        )
+        self.assertNotIn('Content-Encoding', resp.headers)
+        resp = self.client.get(
+            '/api/v1/mean_time_weekday/1', headers={'Accept-Encoding': 'gzip'}
+        )
+        self.assertEqual(resp.status_code, 404)
+        self.assertNotIn('Content-Encoding', resp.headers)
+
+    def test_compressed_cache(self):
+        """
+        Test if repeated responses are compressed once.
+        """
+        middleware = main.app.wsgi_app
+        middleware.cache.clear()
+        for i in range(3):
+            self.client.get(
+                '/api/v1/presence_weekday/10',
+                headers={'Accept-Encoding': 'gzip'}
+            )
+        self.assertEqual(len(middleware.cache), 1)
+
+        main.app.config.update({'COMPRESS_CACHE_SIZE': 1})
+        self.client.get(
+            '/api/v1/presence_weekday/11', headers={'Accept-Encoding': 'gzip'}
+        )
+        main.app.config.pop('COMPRESS_CACHE_SIZE')
+        self.assertEqual(len(middleware.cache), 1)
+
+
+class PresenceAnalyzerAssetsTestCase(unittest.TestCase):
+    """
+    Fingerprinted static assets tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        main.app.config.update({'ASSETS_DIR': self.tmp_dir})
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.config.pop('ASSETS_DIR')
+        shutil.rmtree(self.tmp_dir)
+
+    def test_asset_url_fallback(self):
+        """
+        Test asset URLs before assets are built.
+        """
+        resp = self.client.get('/presence_weekday.html')
+        self.assertIn('/static/js/jquery.min.js', resp.data)
+
+    def test_build_assets(self):
+        """
+        Test building and serving fingerprinted assets.
+        """
+        manifest = assets.build_assets(main.app.static_folder, self.tmp_dir)
+        self.assertItemsEqual(manifest.keys(), [
+            'css/base.css',
+            'css/normalize.css',
+            'img/loading.gif',
+            'js/jquery.min.js',
+        ])
+        jquery = manifest['js/jquery.min.js']
+        self.assertRegexpMatches(jquery, r'^js/jquery\.min\.[0-9a-f]{12}\.js$')
+        self.assertTrue(os.path.exists(
+            os.path.join(self.tmp_dir, jquery + '.gz')
+        ))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tmp_dir, manifest['img/loading.gif'] + '.gz')
+        ))
+
+        resp = self.client.get('/presence_weekday.html')
+        self.assertIn('/assets/' + jquery, resp.data)
+
+        with open(os.path.join(main.app.static_folder, 'js',
+                               'jquery.min.js'), 'rb') as jsfile:
+            original = jsfile.read()
+        resp = self.client.get('/assets/' + jquery)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data, original)
+        self.assertIn('max-age=31536000', resp.headers['Cache-Control'])
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+
+        resp = self.client.get(
+            '/assets/' + jquery, headers={'Accept-Encoding': 'gzip'}
+        )
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('javascript', resp.content_type)
+        body = gzip.GzipFile(fileobj=StringIO.StringIO(resp.data)).read()
+        self.assertEqual(body, original)
+
+        resp = self.client.get('/assets/js/missing.js')
+        self.assertEqual(resp.status_code, 404)
+
+
+class PresenceAnalyzerFormatsTestCase(unittest.TestCase):
+    """
+    API wire formats tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+        main.app.config.update({'DATA_XML': TEST_DATA_XML})
+        main.app.config.update({'STORAGE': 'memory'})
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        pass
+
+    def test_to_columnar(self):
+        """
+        Test turning rows into columns.
+        """
+        self.assertEqual(
+            formats.to_columnar([('Mon', 0, 1), ('Tue', 2, 3)]),
+            [['Mon', 'Tue'], [0, 2], [1, 3]]
+        )
+        self.assertEqual(
+            formats.to_columnar([{'a': 1, 'b': 2}, {'a': 3, 'b': 4}]),
+            {'a': [1, 3], 'b': [2, 4]}
+        )
+        self.assertEqual(formats.to_columnar([]), [])
+        self.assertEqual(formats.to_columnar({'a': 1}), {'a': 1})
+        self.assertEqual(formats.to_columnar([(1, 2), (3,)]), [(1, 2), (3,)])
+
+    def test_default_json(self):
+        """
+        Test if JSON is used unless other format is preferred.
+        """
+        for accept in ['', '*/*', 'text/html', 'application/json']:
+            resp = self.client.get(
+                '/api/v1/mean_time_weekday/10', headers={'Accept': accept}
+            )
+            self.assertEqual(resp.content_type, 'application/json')
+
+    def test_columnar(self):
+        """
+        Test columnar JSON responses.
+        """
+        resp = self.client.get(
+            '/api/v1/mean_time_weekday/10',
+            headers={'Accept': formats.COLUMNAR}
+        )
+        self.assertEqual(resp.content_type, formats.COLUMNAR)
+        self.assertEqual(json.loads(resp.data), [
+            [u'Mon', u'Tue', u'Wed', u'Thu', u'Fri', u'Sat', u'Sun'],
+            [0, 30047.0, 24465.0, 23705.0, 0, 0, 0],
+        ])
+
+        resp = self.client.get(
+            '/api/v1/users', headers={'Accept': formats.COLUMNAR}
+        )
+        self.assertEqual(json.loads(resp.data)['user_id'], [176, 170])
+
+    @unittest.skipIf(
+        formats.load_msgpack() is None, 'msgpack is not installed'
+    )
+    def test_msgpack(self):
+        """
+        Test MessagePack responses.
+        """
+        resp = self.client.get(
+            '/api/v1/mean_start_end/10',
+            headers={'Accept': 'application/x-msgpack, */*;q=0.1'}
+        )
+        self.assertEqual(resp.content_type, formats.MSGPACK)
+        self.assertIn('Accept', resp.headers['Vary'])
+        data = formats.load_msgpack().unpackb(resp.data)
+        self.assertEqual(data[1], [0, 34745.0, 33592.0, 38926.0, 0, 0, 0])
+
+    def test_benchmark(self):
+        """
+        Test comparing formats.
+        """
+        datasets = [
+            [('Mon', 30000.0, 60000.0)] * 7,
+            [{'user_id': 1, 'name': 'A', 'avatar': 'url'}] * 10,
+        ]
+        results = formats.benchmark(datasets, 1)
+        result = dict(
+            (mimetype, size)
+            for mimetype, size, gzip_size, seconds in results
+        )
+        compact = result[formats.JSON + ' (compact)']
+        self.assertLess(compact, result[formats.JSON])
+        self.assertLess(result[formats.COLUMNAR], compact)
+        self.assertTrue(all(
+            0 < gzip_size < size
+            for mimetype, size, gzip_size, seconds in results
+        ))
+        if formats.load_msgpack() is not None:
+            self.assertLess(result[formats.MSGPACK], result[formats.COLUMNAR])
+
+
+class PresenceAnalyzerExportTestCase(unittest.TestCase):
+    """
+    Static API export tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+        main.app.config.update({'DATA_XML': TEST_DATA_XML})
+        main.app.config.update({'STORAGE': 'memory'})
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.tmp_dir, 'export')
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def test_export_static(self):
+        """
+        Test if exported files match API responses.
+        """
+        os.makedirs(os.path.join(self.output_dir, 'stale'))
+        self.assertEqual(export.export_static(self.output_dir, 2), 7)
+        self.assertEqual(os.listdir(self.tmp_dir), ['export'])
+        self.assertItemsEqual(
+            os.listdir(os.path.join(self.output_dir, 'api', 'v1')),
+            ['users', 'users.gz', 'mean_time_weekday', 'presence_weekday',
+             'mean_start_end']
+        )
+        for url in ['/api/v1/users'] + export.user_urls(10):
+            path = os.path.join(self.output_dir, *url.strip('/').split('/'))
+            with open(path, 'rb') as jsonfile:
+                self.assertEqual(jsonfile.read(), self.client.get(url).data)
+            gzfile = gzip.open(path + '.gz', 'rb')
+            self.assertEqual(gzfile.read(), self.client.get(url).data)
+            gzfile.close()
+        self.assertTrue(os.path.exists(os.path.join(
+            self.output_dir, 'api', 'v1', 'mean_start_end', '11'
+        )))
+
+
+class PresenceAnalyzerLoadtestTestCase(unittest.TestCase):
+    """
+    Load testing harness tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+        main.app.config.update({'DATA_XML': TEST_DATA_XML})
+        main.app.config.update({'STORAGE': 'memory'})
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        pass
+
+    def test_parse_mix(self):
+        """
+        Test parsing endpoint mix.
+        """
+        self.assertEqual(
+            loadtest.parse_mix('users:1, mean_start_end:2.5,presence_weekday'),
+            [('users', 1), ('mean_start_end', 2.5), ('presence_weekday', 1)]
+        )
+        self.assertRaises(ValueError, loadtest.parse_mix, 'avatars:1')
+
+    def test_build_plan(self):
+        """
+        Test drawing requests from endpoint mix.
+        """
+        mix = [('users', 1), ('mean_start_end', 3)]
+        plan = loadtest.build_plan([10, 11], mix, 1000)
+        self.assertEqual(len(plan), 1000)
+        self.assertEqual(plan, loadtest.build_plan([10, 11], mix, 1000))
+        counts = dict(
+            (endpoint, len([x for x in plan if x[0] == endpoint]))
+            for endpoint, weight in mix
+        )
+        self.assertTrue(200 < counts['users'] < 300)
+        self.assertIn(('mean_start_end', '/api/v1/mean_start_end/11'), plan)
+
+    def test_percentile(self):
+        """
+        Test nearest rank percentiles.
+        """
+        values = range(1, 101)
+        self.assertEqual(loadtest.percentile(values, 0.5), 50)
+        self.assertEqual(loadtest.percentile(values, 0.99), 99)
+        self.assertEqual(loadtest.percentile(values, 1.0), 100)
+        self.assertEqual(loadtest.percentile([7], 0.95), 7)
+        self.assertEqual(loadtest.percentile([], 0.5), 0)
+
+    def test_run_load(self):
+        """
+        Test driving requests against local server.
+        """
+        server = make_server('127.0.0.1', 0, main.app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            plan = loadtest.build_plan(
+                [10, 1], loadtest.parse_mix(loadtest.DEFAULT_MIX), 40
+            )
+            result = loadtest.run_load(
+                'http://127.0.0.1:{0}'.format(server.server_port), plan, 4
+            )
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        rows = loadtest.summarize(4, result)
+        self.assertEqual(rows[-1]['endpoint'], 'all')
+        self.assertEqual(rows[-1]['requests'], 40)
+        self.assertEqual(rows[-1]['errors'], 0)
+        # user 1 has no presence data
+        self.assertGreater(rows[-1]['client_errors'], 0)
+        self.assertEqual(
+            len(sum(result['latencies'].values(), [])),
+            40 - rows[-1]['client_errors']
+        )
+        for row in rows:
+            self.assertLessEqual(row['p50'], row['p95'])
+            self.assertLessEqual(row['p95'], row['p99'])
+        self.assertIn('mean_start_end', loadtest.format_rows(rows))
+
+    def test_start_server(self):
+        """
+        Test serving app from a separate process.
+        """
+        process, port = loadtest.start_server(main.app, 2, 1, 0)
+        try:
+            self.assertNotEqual(process.pid, os.getpid())
+            resp = urllib2.urlopen(
+                'http://127.0.0.1:{0}/healthz'.format(port), timeout=10
+            )
+            self.assertEqual(json.loads(resp.read())['status'], 'ok')
+        finally:
+            process.terminate()
+            process.join(10)
+        self.assertFalse(process.is_alive())
+
+
+@unittest.skipIf(BaseApplication is None, 'gunicorn is not installed')
+class PresenceAnalyzerPreforkTestCase(unittest.TestCase):
+    """
+    Pre-forking server tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+        main.app.config.update({'DATA_XML': TEST_DATA_XML})
+        main.app.config.update({'STORAGE': 'memory'})
+        main.app.config.update({'DATA_WATCH': True})
+        self.serve = script.make_prefork_server(
+            host='127.0.0.1', port='8081', worker_class='gthread',
+            workers='3', threads='8', max_requests='10',
+        )
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        watcher.stop_watcher()
+        main.app.config.pop('DATA_WATCH')
+        warmup.state.update({
+            'enabled': False,
+            'running': False,
+            'ready': False,
+            'started': None,
+            'finished': None,
+            'steps': [],
+        })
+
+    def test_options(self):
+        """
+        Test mapping paste server options to gunicorn settings.
+        """
+        options = self.serve.options
+        self.assertEqual(options['bind'], '127.0.0.1:8081')
+        self.assertEqual(options['worker_class'], 'gthread')
+        self.assertEqual(options['workers'], 3)
+        self.assertEqual(options['threads'], 8)
+        self.assertEqual(options['max_requests'], 10)
+
+    def test_post_fork(self):
+        """
+        Test resetting state inherited from the master in a worker.
+        """
+        backend = storage.get_storage()
+        avatars.user_lock(176).acquire()
+        self.serve.options['post_fork'](None, None)
+        self.assertIsNot(storage.get_storage(), backend)
+        lock = avatars.user_lock(176)
+        self.assertTrue(lock.acquire(False))
+        lock.release()
+        self.assertTrue(watcher.start_watcher(main.app).is_alive())
+
+    def test_post_worker_init(self):
+        """
+        Test if only the first worker prefetches avatars.
+        """
+        calls = []
+        original = avatars.prefetch
+        avatars.prefetch = lambda: calls.append(1)
+        main.app.config.update({'AVATAR_PREFETCH': True})
+        try:
+            for age in (1, 2, 3):
+                worker = type('Worker', (object,), {'age': age})()
+                self.serve.options['post_worker_init'](worker)
+            for thread in threading.enumerate():
+                if thread.name == 'avatar-prefetch':
+                    thread.join(5)
+        finally:
+            avatars.prefetch = original
+            main.app.config.pop('AVATAR_PREFETCH')
+        self.assertEqual(calls, [1])
+
+    def test_serve(self):
+        """
+        Test if master is quiet before forking workers.
+        """
+        seen = {}
+
+        def run(application):
+            """
+            Stands in for running gunicorn arbiter.
+            """
+            seen['workers'] = application.cfg.workers
+            seen['ready'] = warmup.status()['ready']
+            seen['watching'] = 'thread' in watcher._watcher
+            seen['app'] = application.load()
+
+        watcher.start_watcher(main.app)
+        warmup.start_warmup(main.app)
+        original = BaseApplication.run
+        BaseApplication.run = run
+        try:
+            self.serve(main.app)
+        finally:
+            BaseApplication.run = original
+        self.assertEqual(seen, {
+            'workers': 3, 'ready': True, 'watching': False, 'app': main.app,
+        })
+
+
+class PresenceAnalyzerStartupTestCase(unittest.TestCase):
+    """
+    Startup time tests.
+    """
+
+    def test_import_budget(self):
+        """
+        Test if cold import of the package fits the budget.
+        """
+        self.assertLessEqual(
+            startup.import_overhead(), startup.IMPORT_TIME_BUDGET
+        )
+
+    def test_lazy_imports(self):
+        """
+        Test if heavy modules are not imported with the package.
+        """
+        result = startup.measure_import('presence_analyzer')
+        self.assertIn('flask', result['modules'])
+        eager = [
+            name for name in startup.LAZY_MODULES
+            if name in result['modules']
+        ]
+        self.assertEqual(eager, [])
+
+
+class PresenceAnalyzerAvatarsTestCase(unittest.TestCase):
+    """
+    Avatar cache tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.server = BaseHTTPServer.HTTPServer(
+            ('127.0.0.1', 0), StandInHandler
+        )
+        gif_path = os.path.join(main.app.static_folder, 'img', 'loading.gif')
+        with open(gif_path, 'rb') as giffile:
+            self.server.body = giffile.read()
+        self.server.content_type = 'image/gif'
+        self.server.queue = []
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.tmp_dir = tempfile.mkdtemp()
+        xml_path = os.path.join(self.tmp_dir, 'users.xml')
+        with open(TEST_DATA_XML, 'r') as xmlfile:
+            xml = xmlfile.read()
+        xml = xml.replace('intranet.stxnext.pl', '127.0.0.1')
+        xml = xml.replace('<port>443</port>', '<port>{0}</port>'.format(
+            self.server.server_port
+        ))
+        xml = xml.replace('https', 'http')
+        with open(xml_path, 'w') as xmlfile:
+            xmlfile.write(xml)
+        main.app.config.update({'DATA_XML': xml_path})
+        main.app.config.update({
+            'AVATAR_CACHE_DIR': os.path.join(self.tmp_dir, 'avatars'),
+        })
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        main.app.config.update({'DATA_XML': TEST_DATA_XML})
+        main.app.config.pop('AVATAR_MAX_AGE', None)
+        main.app.config.pop('AVATAR_CACHE_DIR')
+        shutil.rmtree(self.tmp_dir)
+
+    def test_avatar_view(self):
+        """
+        Test serving and revalidating cached avatar.
+        """
+        resp = self.client.get('/avatars/176')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data, self.server.body)
+        self.assertEqual(resp.content_type, 'image/gif')
+        self.assertIn('public', resp.headers['Cache-Control'])
+        self.assertIn('max-age=86400', resp.headers['Cache-Control'])
+        self.assertEqual(
+            self.server.requests[0]['host'],
+            '127.0.0.1:{0}'.format(self.server.server_port)
+        )
+
+        etag = resp.headers['ETag']
+        resp = self.client.get(
+            '/avatars/176', headers={'If-None-Match': etag}
+        )
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(len(self.server.requests), 1)
+
+        main.app.config.update({'AVATAR_MAX_AGE': 0})
+        resp = self.client.get('/avatars/176')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data, self.server.body)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[1]['if-none-match'], '"v1"')
+
+    def test_unknown_user(self):
+        """
+        Test avatar of user missing from DATA_XML.
+        """
+        self.assertEqual(self.client.get('/avatars/1').status_code, 404)
+
+    def test_avatar_urls(self):
+        """
+        Test if DATA_XML is parsed again only after data changes.
+        """
+        with main.app.app_context():
+            urls = avatars.avatar_urls()
+            self.assertIn(176, urls)
+            self.assertIs(avatars.avatar_urls(), urls)
+            utils.bump_generation()
+            self.assertIsNot(avatars.avatar_urls(), urls)
+        resp = self.client.get('/presence_weekday.html')
+        self.assertIn('"/avatars/" + this.user_id', resp.data)
+
+    def test_reset(self):
+        """
+        Test if locks held before fork are dropped.
+        """
+        avatars.user_lock(176).acquire()
+        avatars.reset()
+        lock = avatars.user_lock(176)
+        self.assertTrue(lock.acquire(False))
+        lock.release()
+
+    def test_upstream_failure(self):
+        """
+        Test falling back to remote avatar and stale copy.
+        """
+        self.server.queue = [(500, 'error')]
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        avatars.log.addHandler(handler)
+        try:
+            resp = self.client.get('/avatars/170')
+        finally:
+            avatars.log.removeHandler(handler)
+        self.assertEqual(resp.status_code, 302)
+        # expected network failures are logged without traceback
+        self.assertEqual(len(records), 1)
+        self.assertFalse(records[0].exc_info)
+        self.assertTrue(
+            resp.headers['Location'].endswith('/api/images/users/170')
+        )
+
+        self.assertEqual(self.client.get('/avatars/170').status_code, 200)
+        main.app.config.update({'AVATAR_MAX_AGE': 0})
+        self.server.queue = [(500, 'error')]
+        resp = self.client.get('/avatars/170')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data, self.server.body)
+
+    def test_prefetch(self):
+        """
+        Test downloading avatars of all users.
+        """
+        avatars.start_prefetch().join(10)
+        with main.app.app_context():
+            self.assertTrue(os.path.exists(avatars.avatar_path(176)))
+            self.assertTrue(os.path.exists(avatars.avatar_path(170)))
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_evict(self):
+        """
+        Test evicting least recently used avatars.
+        """
+        with main.app.app_context():
+            for user_id, atime in [(1, 300), (2, 100), (3, 200)]:
+                path = avatars.avatar_path(user_id)
+                with open(path, 'w') as avatarfile:
+                    avatarfile.write('x' * 10)
+                with open(refresh.meta_path(path), 'w') as metafile:
+                    metafile.write('{}')
+                os.utime(path, (atime, atime))
+            avatars.evict(20)
+            cached = sorted(os.listdir(avatars.cache_dir()))
+        self.assertEqual(cached, ['1', '1.meta', '3', '3.meta'])
+
+
+class PresenceAnalyzerMemoryTestCase(unittest.TestCase):
+    """
+    Memory diagnostics tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+        main.app.config.update({'DATA_XML': TEST_DATA_XML})
+        main.app.config.update({'STORAGE': 'memory'})
+        main.app.config.update({'MEMORY_DIAGNOSTICS': True})
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.config.update({'MEMORY_DIAGNOSTICS': False})
+
+    def test_deep_size(self):
+        """
+        Test size of nested structures.
+        """
+        item = [1000, 2000]
+        self.assertEqual(
+            memory.deep_size(item),
+            sys.getsizeof(item) + sys.getsizeof(1000) + sys.getsizeof(2000)
+        )
+        nested = {'a': item, 'b': item}
+        self.assertEqual(
+            memory.deep_size(nested),
+            sys.getsizeof(nested) + sys.getsizeof('a') +
+            sys.getsizeof('b') + memory.deep_size(item)
+        )
+        self.assertEqual(
+            memory.deep_size([len]), sys.getsizeof([len])
+        )
+
+    def test_compare_snapshots(self):
+        """
+        Test differences of object counts.
+        """
+        before = memory.take_snapshot()
+        kept = [set() for i in range(1000)]
+        after = memory.take_snapshot()
+        diff = memory.compare_snapshots(before, after, limit=3)
+        self.assertLessEqual(len(diff), 3)
+        if isinstance(before, memory.Counter):
+            self.assertEqual(diff[0], {'type': 'set', 'count_diff': 1000})
+        self.assertEqual(len(kept), 1000)
+
+    def test_memory_view(self):
+        """
+        Test memory report.
+        """
+        self.client.get('/api/v1/presence_weekday/10')
+        resp = self.client.get('/diagnostics/memory?diff=1&limit=5')
+        self.assertEqual(resp.status_code, 200)
+        report = json.loads(resp.data)
+        structures = dict(
+            (entry['name'], entry) for entry in report['structures']
+        )
+        self.assertEqual(structures['get_data']['users'], 2)
+        self.assertGreater(structures['data_from_xml']['size'], 0)
+        self.assertIn('memory_storage_stats', structures)
+        cache_names = [entry['name'] for entry in report['cache']]
+        self.assertIn('get_data()', cache_names)
+        self.assertLessEqual(len(report['reload_diff']), 5)
+
+    def test_memory_view_disabled(self):
+        """
+        Test if memory report is hidden unless enabled.
+        """
+        main.app.config.update({'MEMORY_DIAGNOSTICS': False})
+        resp = self.client.get('/diagnostics/memory')
+        self.assertEqual(resp.status_code, 404)
+
+
+class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
+    """
+    Utility functions tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+        main.app.config.update({'DATA_XML': TEST_DATA_XML})
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        pass
+
+    def test_get_data(self):
+        """
+        Test parsing of CSV file.
+        """
+        data = utils.get_data()
+        self.assertIsInstance(data, dict)
+        self.assertItemsEqual(data.keys(), [10, 11])
+        sample_date = datetime.date(2013, 9, 10)
+        self.assertIn(sample_date, data[10])
+        self.assertItemsEqual(data[10][sample_date].keys(), ['start', 'end'])
+        self.assertEqual(
+            data[10][sample_date]['start'],
+            datetime.time(9, 39, 5)
+        )
+
+    def test_seconds_since_midnight(self):
+        """
+        Test if seconds are computed correctly.
+        """
+        data = utils.seconds_since_midnight(datetime.time(1, 2, 3))
+        self.assertEqual(data, 3723)
+
+    def test_interval(self):
+        """
+        Test if interval is computed correctly.
+        """
+        start = datetime.time(1)
+        end = datetime.time(1, 2, 3)
+        data = utils.interval(start, end)
+        self.assertEqual(data, 123)
+
+    def test_mean(self):
+        """
+        Test calculation of arithmetic mean.
+        """
+        self.assertEqual(utils.mean([0]), 0)
+        self.assertEqual(utils.mean(range(1, 10)), 5.)
+        self.assertEqual(utils.mean(range(1, 5)), 2.5)
+        self.assertIsInstance(utils.mean([0]), float)
+
+    def test_mean_of_sum(self):
+        """
+        Test calculation of arithmetic mean from sum.
+        """
+        self.assertEqual(utils.mean_of_sum(0, 0), 0)
+        self.assertEqual(utils.mean_of_sum(5, 2), 2.5)
+        self.assertIsInstance(utils.mean_of_sum(4, 2), float)
+
+    def test_group_by_weekday(self):
+        """
+        Test if function correctly groups by weekdays.
+        """
+        data = utils.get_data()
+        li = [[], [30047], [24465], [23705], [], [], []]
+        self.assertEqual(utils.group_by_weekday(data[10]), li)
+
+    def test_cache(self):
+        """
+        Tests cache functionality.
+        """
+        decorator = utils.cache(utils.get_data())
+        data = decorator.func_globals['cached_data']
+        result = [v for k, v in data.items()]
+        expected = {
+            datetime.date(2013, 9, 10): {
+                'end': datetime.time(17, 59, 52),
+                'start': datetime.time(9, 39, 5)
+                },
+            datetime.date(2013, 9, 11): {
+                'end': datetime.time(16, 7, 37),
+                'start': datetime.time(9, 19, 52)
+                },
+            datetime.date(2013, 9, 12): {
+                'end': datetime.time(17, 23, 51),
+                'start': datetime.time(10, 48, 46)
+                },
+            }
+        self.assertEqual(expected, result[0][10])
+
+    def test_cache_generation(self):
+        """
+        Test if cached values are dropped when data generation changes.
+        """
+        calls = []
+
+        @utils.cache(600)
+        def cached_function():
+            """
+            Counts calls.
+            """
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(cached_function(), 1)
+        self.assertEqual(cached_function(), 1)
+        generation = utils.get_generation()
+        self.assertEqual(utils.bump_generation(), generation + 1)
+        self.assertEqual(cached_function(), 2)
 
     def test_data_from_xml(self):
         """
@@ -253,6 +1652,24 @@ def suite():
     """
     base_suite = unittest.TestSuite()
     base_suite.addTest(unittest.makeSuite(PresenceAnalyzerViewsTestCase))
+    base_suite.addTest(
+        unittest.makeSuite(PresenceAnalyzerSQLiteViewsTestCase)
+    )
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerStorageTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerWatcherTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerWarmupTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerRefreshTestCase))
+    base_suite.addTest(
+        unittest.makeSuite(PresenceAnalyzerCompressionTestCase)
+    )
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerAssetsTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerFormatsTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerExportTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerLoadtestTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerPreforkTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerStartupTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerAvatarsTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerMemoryTestCase))
     base_suite.addTest(unittest.makeSuite(PresenceAnalyzerUtilsTestCase))
     return base_suite
 
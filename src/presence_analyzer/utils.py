@@ -3,27 +3,55 @@
 Helper functions used in views.
 """
 
-import csv
+import os
 import time
+import hashlib
 import logging
 from datetime import datetime
 from functools import wraps
-from json import dumps
 from threading import Lock
 
-from flask import Response
-from lxml import etree
+from flask import Response, request
 
 from presence_analyzer.main import app
+from presence_analyzer import formats
 
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 cached_data = {}
 
+# Readable names of cached_data keys, used in memory diagnostics.
+cache_names = {}
+
+# Bumped whenever data files change, see bump_generation().
+data_generation = 0
+generation_lock = Lock()
+
+
+def get_generation():
+    """
+    Returns current data generation number.
+    """
+    return data_generation
+
+
+def bump_generation():
+    """
+    Invalidates cached data and returns new data generation number.
+    """
+    global data_generation  # pylint: disable=global-statement
+    with generation_lock:
+        data_generation += 1
+        return data_generation
+
 
 def cache(timeout=600):
     """
     Cashes data.
+
+    Cached values expire after timeout seconds or when data generation
+    changes. The timeout is ignored when DATA_WATCH is enabled, because
+    the watcher bumps the generation as soon as data files change.
     """
 
     def middle(function):
@@ -31,6 +59,7 @@ def cache(timeout=600):
         Middle decorator function.
         """
         time_stamp = {}
+        generations = {}
         lock = Lock()
 
         def inner(*args, **kwargs):
@@ -39,16 +68,22 @@ def cache(timeout=600):
             """
             key = hash(function.__name__+repr(args)+repr(kwargs))
             current_time = time.time()
+            generation = data_generation
 
             def time_diff():
+                if app.config.get('DATA_WATCH'):
+                    return False
                 if current_time - time_stamp[key] >= timeout:
                     return True
                 else:
                     return False
             with lock:
-                if key not in cached_data or time_diff():
+                if (key not in cached_data or time_diff() or
+                        generations[key] != generation):
                     time_stamp[key] = current_time
+                    generations[key] = generation
                     cached_data[key] = function(*args, **kwargs)
+                    cache_names[key] = function.__name__ + repr(args)
             return cached_data[key]
         return inner
     return middle
@@ -57,19 +92,50 @@ def cache(timeout=600):
 def jsonify(function):
     """
     Creates a response with the JSON representation of wrapped function result.
+
+    Clients may ask for columnar JSON or MessagePack in Accept header,
+    see presence_analyzer.formats.
     """
     @wraps(function)
     def inner(*args, **kwargs):
         """
         This docstring will be overridden by @wraps decorator.
         """
-        return Response(
-            dumps(function(*args, **kwargs)),
-            mimetype='application/json'
-        )
+        mimetype, encoder = formats.negotiate(request.accept_mimetypes)
+        etag = response_etag(mimetype)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(
+                encoder(function(*args, **kwargs)),
+                mimetype=mimetype
+            )
+        response.set_etag(etag)
+        response.vary.add('Accept')
+        return response
     return inner
 
 
+def response_etag(mimetype):
+    """
+    Returns ETag of API response to current request in given format.
+
+    It changes with data generation and with size or modification time
+    of data files, as generation numbers start from zero in every
+    process.
+    """
+    files = []
+    for key in ('DATA_CSV', 'DATA_XML'):
+        try:
+            stat = os.stat(app.config[key])
+            files.append((stat.st_size, stat.st_mtime))
+        except (KeyError, OSError):
+            files.append(None)
+    return hashlib.md5(repr(
+        (data_generation, files, request.path, mimetype)
+    )).hexdigest()
+
+
 @cache(600)
 def get_data():
     """
@@ -89,6 +155,7 @@ def get_data():
         }
     }
     """
+    import csv
     data = {}
     with open(app.config['DATA_CSV'], 'r') as csvfile:
         presence_reader = csv.reader(csvfile, delimiter=',')
@@ -143,6 +210,14 @@ def mean(items):
     return float(sum(items)) / len(items) if len(items) > 0 else 0
 
 
+def mean_of_sum(total, count):
+    """
+    Calculates arithmetic mean from sum and number of items.
+    Returns zero when there are no items.
+    """
+    return float(total) / count if count > 0 else 0
+
+
 def group_by_weekday_start_end(items):
     """
     Groups presence srart/end by weekday.
@@ -171,6 +246,7 @@ def data_from_xml():
     """
     Gets data from xml file.
     """
+    from lxml import etree
     filename = app.config['DATA_XML']
     with open(filename, 'r') as xmlfile:
         xml = etree.parse(xmlfile)
@@ -3,11 +3,20 @@
 Defines views.
 """
 
+import os
 import calendar
-from flask import redirect, abort, render_template, url_for
+import mimetypes
+from json import dumps
+
+from flask import (
+    redirect, abort, render_template, url_for, Response, request,
+    send_from_directory,
+)
 
 from presence_analyzer.main import app
-from presence_analyzer import utils
+from presence_analyzer import (
+    utils, storage, warmup, assets, compress, avatars,
+)
 
 import logging
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
@@ -45,6 +54,61 @@ def render_mean_start_end():
     return render_template('presence_start_end.html')
 
 
+@app.route('/assets/<path:filename>')
+def assets_view(filename):
+    """
+    Serves fingerprinted static assets, precompressed when possible.
+    """
+    assets_dir = app.config.get('ASSETS_DIR')
+    if not assets_dir:
+        abort(404)
+
+    encoding = compress.accepted_encoding(
+        request.headers.get('Accept-Encoding', '')
+    )
+    gzipped = os.path.join(assets_dir, filename + '.gz')
+    if encoding == 'gzip' and os.path.isfile(gzipped):
+        response = send_from_directory(
+            assets_dir, filename + '.gz',
+            mimetype=mimetypes.guess_type(filename)[0],
+            cache_timeout=assets.MAX_AGE,
+        )
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_from_directory(
+            assets_dir, filename, cache_timeout=assets.MAX_AGE
+        )
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.cache_control.public = True
+    response.headers['Cache-Control'] += ', immutable'
+    return response
+
+
+@app.route('/avatars/<int:user_id>')
+def avatar_view(user_id):
+    """
+    Serves user avatar from local cache.
+    """
+    from presence_analyzer.refresh import load_meta
+    url = avatars.avatar_urls().get(user_id)
+    if url is None:
+        log.debug('User %s not found!', user_id)
+        abort(404)
+
+    path = avatars.fetch(user_id, url)
+    if path is None:
+        return redirect(url)
+    avatars.touch(path)
+    response = send_from_directory(
+        os.path.dirname(path), os.path.basename(path),
+        mimetype=load_meta(path).get('content_type', 'image/png'),
+        cache_timeout=app.config.get('AVATAR_MAX_AGE', 24 * 3600),
+        conditional=True,
+    )
+    response.cache_control.public = True
+    return response
+
+
 @app.route('/api/v1/users', methods=['GET'])
 @utils.jsonify
 def users_view():
@@ -62,15 +126,17 @@ def mean_time_weekday_view(user_id):
     """
     Returns mean presence time of given user grouped by weekday.
     """
-    data = utils.get_data()
-    if user_id not in data:
+    weekdays = storage.get_storage().weekday_stats(user_id)
+    if weekdays is None:
         log.debug('User %s not found!', user_id)
         abort(404)
 
-    weekdays = utils.group_by_weekday(data[user_id])
     result = [
-        (calendar.day_abbr[weekday], utils.mean(intervals))
-        for weekday, intervals in enumerate(weekdays)
+        (
+            calendar.day_abbr[weekday],
+            utils.mean_of_sum(stats['total'], stats['count']),
+        )
+        for weekday, stats in enumerate(weekdays)
     ]
     return result
 
@@ -82,15 +148,14 @@ def presence_weekday_view(user_id):
     """
     Returns total presence time of given user grouped by weekday.
     """
-    data = utils.get_data()
-    if user_id not in data:
+    weekdays = storage.get_storage().weekday_stats(user_id)
+    if weekdays is None:
         log.debug('User %s not found!', user_id)
         abort(404)
 
-    weekdays = utils.group_by_weekday(data[user_id])
     result = [
-        (calendar.day_abbr[weekday], sum(intervals))
-        for weekday, intervals in enumerate(weekdays)
+        (calendar.day_abbr[weekday], stats['total'])
+        for weekday, stats in enumerate(weekdays)
     ]
 
     result.insert(0, ('Weekday', 'Presence (s)'))
@@ -104,17 +169,58 @@ def mean_start_end_view(user_id):
     """
     Returns mean start/end presence time of given user grouped by weekday.
     """
-    data = utils.get_data()
-    if user_id not in data:
+    weekdays = storage.get_storage().weekday_stats(user_id)
+    if weekdays is None:
         log.debug('User %s not found!', user_id)
         abort(404)
-    weekdays = utils.group_by_weekday_start_end(data[user_id])
     result = [
         (
             calendar.day_abbr[weekday],
-            utils.mean_from_list(hours, 0),
-            utils.mean_from_list(hours, 1),
+            utils.mean_of_sum(stats['start'], stats['count']),
+            utils.mean_of_sum(stats['end'], stats['count']),
         )
-        for weekday, hours in enumerate(weekdays)
+        for weekday, stats in enumerate(weekdays)
     ]
     return result
+
+
+@app.route('/healthz', methods=['GET'])
+@utils.jsonify
+def healthz_view():
+    """
+    Liveness check.
+    """
+    return {'status': 'ok', 'uptime': warmup.status()['uptime']}
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz_view():
+    """
+    Readiness check reporting warm-up progress.
+
+    Responds with 503 until warm-up is finished.
+    """
+    report = warmup.status()
+    return Response(
+        dumps(report),
+        status=200 if report['ready'] else 503,
+        mimetype='application/json'
+    )
+
+
+@app.route('/diagnostics/memory', methods=['GET'])
+def memory_view():
+    """
+    Memory usage of caches and data structures.
+
+    Available only when MEMORY_DIAGNOSTICS is enabled. With ?diff=1 data
+    is reloaded and memory differences it caused are reported too.
+    """
+    if not app.config.get('MEMORY_DIAGNOSTICS'):
+        abort(404)
+    from presence_analyzer import memory
+    report = memory.memory_report(
+        diff=request.args.get('diff') == '1',
+        limit=request.args.get('limit', 10, type=int),
+    )
+    return Response(dumps(report), mimetype='application/json')
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Preloads data in the background before a worker takes traffic.
+"""
+
+import time
+import logging
+import threading
+
+from presence_analyzer import utils, storage
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+STARTED_AT = time.time()
+
+state = {  # pylint: disable=invalid-name
+    'enabled': False,
+    'running': False,
+    'ready': False,
+    'started': None,
+    'finished': None,
+    'steps': [],
+}
+state_lock = threading.Lock()  # pylint: disable=invalid-name
+_thread = {}
+
+
+def warm_presence():
+    """
+    Loads presence data into the configured storage backend.
+    """
+    storage.get_storage().load()
+
+
+def warm_users():
+    """
+    Parses the user directory.
+    """
+    utils.data_from_xml()
+
+
+def warm_aggregates():
+    """
+    Computes per weekday statistics of every user.
+    """
+    backend = storage.get_storage()
+    for user_id in backend.user_ids():
+        backend.weekday_stats(user_id)
+
+
+STEPS = [
+    ('presence', warm_presence),
+    ('users', warm_users),
+    ('aggregates', warm_aggregates),
+]
+
+
+def run_warmup(app, steps=None):
+    """
+    Runs warm-up steps one by one and records their progress.
+    """
+    steps = STEPS if steps is None else steps
+    with state_lock:
+        state.update({
+            'enabled': True,
+            'running': True,
+            'ready': False,
+            'started': time.time(),
+            'finished': None,
+            'steps': [
+                {'name': name, 'status': 'pending', 'duration': None}
+                for name, function in steps
+            ],
+        })
+
+    failed = False
+    with app.app_context():
+        for (name, function), step in zip(steps, state['steps']):
+            step['status'] = 'running'
+            start = time.time()
+            try:
+                function()
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Warm-up step %s failed', name)
+                step['status'] = 'failed'
+                failed = True
+            else:
+                step['status'] = 'done'
+            step['duration'] = time.time() - start
+            log.info(
+                'Warm-up step %s %s in %.3fs',
+                name, step['status'], step['duration']
+            )
+
+    with state_lock:
+        state['running'] = False
+        state['ready'] = not failed
+        state['finished'] = time.time()
+
+
+def start_warmup(app, steps=None):
+    """
+    Starts warm-up in a background thread.
+
+    Does nothing while warm-up is running or after it succeeded. Warm-up
+    interrupted by forking a worker process starts again in the worker.
+    """
+    with state_lock:
+        thread = _thread.get('thread')
+        if state['ready'] or (thread is not None and thread.is_alive()):
+            return None
+        state['enabled'] = True
+        state['running'] = True
+        thread = threading.Thread(
+            target=run_warmup, args=(app, steps), name='presence-warmup'
+        )
+        thread.daemon = True
+        _thread['thread'] = thread
+        thread.start()
+    return thread
+
+
+def wait_warmup(timeout=None):
+    """
+    Waits until running warm-up finishes.
+    """
+    thread = _thread.get('thread')
+    if thread is not None:
+        thread.join(timeout)
+
+
+def status():
+    """
+    Returns warm-up progress report.
+
+    Workers started without warm-up are always ready.
+    """
+    with state_lock:
+        report = {
+            'ready': state['ready'] or not state['enabled'],
+            'uptime': time.time() - STARTED_AT,
+            'steps': [dict(step) for step in state['steps']],
+        }
+        if state['started'] is not None:
+            end = state['finished'] or time.time()
+            report['duration'] = end - state['started']
+    return report
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Watches data files and reloads data when they change.
+"""
+
+import os
+import time
+import logging
+import threading
+
+try:
+    import pyinotify
+except ImportError:  # pragma: no cover
+    pyinotify = None  # pylint: disable=invalid-name
+
+from presence_analyzer import utils, storage
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+_watcher = {}
+_watcher_lock = threading.Lock()
+
+
+def file_state(path):
+    """
+    Returns a tuple describing file contents version, None if it's missing.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+
+class FileWatcher(threading.Thread):
+    """
+    Calls callback once watched files stop changing.
+
+    Changes are detected with inotify when pyinotify is installed,
+    otherwise files are polled every interval seconds. Callback is
+    called after no change was seen for debounce seconds, so a burst
+    of writes triggers a single call.
+    """
+
+    def __init__(self, paths, callback, interval=1.0, debounce=0.5,
+                 use_inotify=True):
+        super(FileWatcher, self).__init__(name='presence-data-watcher')
+        self.daemon = True
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.callback = callback
+        self.interval = interval
+        self.debounce = debounce
+        self.stopped = threading.Event()
+        self.states = self.snapshot()
+        self.last_change = None
+        self.notifier = None
+        if use_inotify and pyinotify is not None:
+            self.notifier = self.make_notifier()
+
+    def make_notifier(self):
+        """
+        Creates inotify notifier watching directories of watched files.
+
+        Directories are watched, so files replaced by rename are noticed.
+        """
+        manager = pyinotify.WatchManager()
+        mask = (
+            pyinotify.IN_MODIFY | pyinotify.IN_CLOSE_WRITE |
+            pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+            pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM
+        )
+        for directory in set(os.path.dirname(path) for path in self.paths):
+            manager.add_watch(directory, mask)
+        return pyinotify.Notifier(manager, lambda event: None)
+
+    def snapshot(self):
+        """
+        Returns states of all watched files.
+        """
+        return dict((path, file_state(path)) for path in self.paths)
+
+    def wait(self, timeout):
+        """
+        Waits for file system events or until timeout passes.
+        """
+        if self.notifier is None:
+            self.stopped.wait(timeout)
+            return
+        if self.notifier.check_events(timeout=int(timeout * 1000)):
+            self.notifier.read_events()
+            self.notifier.process_events()
+
+    def check(self):
+        """
+        Checks watched files and calls callback when they settled down.
+        """
+        states = self.snapshot()
+        now = time.time()
+        if states != self.states:
+            self.states = states
+            self.last_change = now
+        elif (self.last_change is not None and
+              now - self.last_change >= self.debounce):
+            self.last_change = None
+            try:
+                self.callback()
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Data reload failed')
+
+    def run(self):
+        """
+        Watches files until stopped.
+        """
+        try:
+            while not self.stopped.is_set():
+                if self.last_change is None:
+                    self.wait(self.interval)
+                else:
+                    self.wait(min(self.interval, self.debounce))
+                self.check()
+        finally:
+            if self.notifier is not None:
+                self.notifier.stop()
+
+    def stop(self):
+        """
+        Stops watching files.
+        """
+        self.stopped.set()
+
+
+def reload_data():
+    """
+    Bumps data generation and loads fresh presence data into the
+    configured storage backend.
+    """
+    generation = utils.bump_generation()
+    log.info('Data files changed, reloading (generation %d)', generation)
+    storage.get_storage().load()
+
+
+def start_watcher(app):
+    """
+    Starts watching DATA_CSV and DATA_XML of given app.
+
+    Watcher is started again in forked worker processes.
+    """
+    with _watcher_lock:
+        if 'thread' in _watcher and _watcher['thread'].is_alive():
+            return _watcher['thread']
+        thread = FileWatcher(
+            [app.config['DATA_CSV'], app.config['DATA_XML']],
+            reload_data,
+            interval=app.config.get('DATA_WATCH_INTERVAL', 1.0),
+            debounce=app.config.get('DATA_WATCH_DEBOUNCE', 0.5),
+        )
+        thread.start()
+        _watcher['thread'] = thread
+        return thread
+
+
+def stop_watcher():
+    """
+    Stops watcher thread and waits until it exits.
+    """
+    with _watcher_lock:
+        thread = _watcher.pop('thread', None)
+    if thread is not None:
+        thread.stop()
+        thread.join()